@@ -1,15 +1,36 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, g
 from flask_restx import Api
 from .utils import db, limiter
 from flask_migrate import Migrate
-from .utils import db, mail, cache
+from .utils import (
+    db,
+    mail,
+    mail_queue,
+    cache,
+    click_counter,
+    click_events,
+    hot_keys,
+    key_pool,
+    key_index,
+    qrcode_cache,
+    revoked_tokens,
+    user_claims,
+    log_pipeline,
+    metrics,
+    query_inspector,
+)
 from .models.urls import Url
+from .models.keys import ReservedKey
 from .models.users import User
 from .models.token import ResetPasswordTokenBlocklist
 from .models.blocklist import TokenBlocklist
+from .models.clicks import ClickEvent
 from .auth.views import auth_namespace
 from .user.views import user_namespace
 from .urls.views import url_namespace
+from .urls.redirect import RedirectMiddleware
+from .urls.commands import urls_cli
+from .seed import seed_command
 from flask_cors import CORS
 
 # from .payments.views import payment_namespace
@@ -20,35 +41,8 @@ from decouple import config as configuration
 
 from .config import config_dict
 
-from logging.config import dictConfig
-
-dictConfig(
-    {
-        "version": 1,
-        "formatters": {
-            "default": {
-                "format": "[%(asctime)s] %(levelname)s in %(module)s: %(message)s",
-                "datefmt": "%B %d, %Y %H:%M:%S %Z",
-            }
-        },
-        "handlers": {
-            "time-rotate": {
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "filename": "urlshortener.log",
-                "when": "D",
-                "interval": 10,
-                "backupCount": 5,
-                "formatter": "default",
-            },
-            "file": {
-                "class": "logging.FileHandler",
-                "filename": "flask.log",
-                "formatter": "default",
-            },
-        },
-        "root": {"level": "INFO", "handlers": ["time-rotate"]},
-    }
-)
+# records are written as JSON lines by a background thread, see LogPipeline
+log_pipeline.start("urlshortener.log", interval=10, backup_count=5)
 
 
 def create_app(config=config_dict["dev"]):
@@ -87,24 +81,52 @@ def create_app(config=config_dict["dev"]):
 
     mail.init_app(app)
 
+    mail_queue.init_app(app)
+
     cache.init_app(app)
 
+    qrcode_cache.init_app(app)
+
     limiter.init_app(app)
 
+    click_counter.init_app(app)
+
+    click_events.init_app(app)
+
+    hot_keys.init_app(app)
+
+    key_pool.init_app(app)
+
+    key_index.init_app(app)
+
+    app.cli.add_command(urls_cli)
+
+    app.cli.add_command(seed_command)
+
+    revoked_tokens.init_app(app)
+
+    user_claims.init_app(app)
+
+    log_pipeline.init_app(app)
+
+    metrics.init_app(app)
+
+    query_inspector.init_app(app)
+
+    @app.before_request
+    def reset_user_identity_map():
+        # the app context, and so g, can outlive a request in tests
+        g.pop("users", None)
+
     jwt = JWTManager(app)
 
     @jwt.additional_claims_loader
     def add_claim_to_jwt(identity):
-        email = User.get_by_id(identity).email
-        if email == configuration("EMAIL"):
-            return {"super_admin": True}
-        return {"super_admin": False}
+        return {"super_admin": user_claims.claims_for(identity)["super_admin"]}
 
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
-        jti = jwt_payload["jti"]
-        token = TokenBlocklist.query.filter_by(jti=jti).first()
-        return token is not None
+        return revoked_tokens.is_revoked(jwt_payload["jti"])
 
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
@@ -146,4 +168,6 @@ def create_app(config=config_dict["dev"]):
             401,
         )
 
+    app.wsgi_app = RedirectMiddleware(app)
+
     return app
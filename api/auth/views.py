@@ -1,5 +1,5 @@
 from flask_restx import Namespace, Resource, fields, marshal
-from flask import request, abort, url_for, copy_current_request_context
+from flask import request, abort, url_for
 from ..models.users import User
 from ..models.blocklist import TokenBlocklist
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -11,12 +11,17 @@ from flask_jwt_extended import (
     get_jwt_identity,
     get_jwt,
 )
-from ..utils import db, generate_confirmation_token, mail
+from ..utils import (
+    db,
+    generate_confirmation_token,
+    mail_queue,
+    revoked_tokens,
+    user_claims,
+)
 from datetime import timezone, datetime
 import validators
 from flask_mail import Message
 
-from threading import Thread
 
 from flask import current_app as app
 
@@ -71,13 +76,7 @@ def send_async(user, confirm_url):
         "<br>"
         "<p>Cheers!</p>",
     )
-
-    @copy_current_request_context
-    def send_message(msg):
-        mail.send(msg)
-
-    sender = Thread(name="mail_sender", target=send_message, args=(msg,))
-    sender.start()
+    mail_queue.send(msg)
 
 
 @auth_namespace.route("signup")
@@ -94,8 +93,11 @@ class SignUp(Resource):
         if not validators.email(data.get("email")):
             abort(400, "Email is not valid")
 
-        user = User.query.filter_by(email=data.get("email")).first()
-        user_name = User.query.filter_by(username=data.get("username")).first()
+        # looks up the email and the username in one query
+        users = User.query.filter(
+            (User.email == data.get("email")) | (User.username == data.get("username"))
+        ).all()
+        user = next((u for u in users if u.email == data.get("email")), None)
 
         # check if a user with the email exists
         if user:
@@ -103,7 +105,7 @@ class SignUp(Resource):
             return {"Error": "User exists"}, HTTPStatus.CONFLICT
 
         # check if a user with the username exists
-        if user_name:
+        if users:
             app.logger.info(
                 f"Someone tried to sign up with a username already taken by someone else"
             )
@@ -127,7 +129,8 @@ class SignUp(Resource):
         send_async(new_user, confirm_url)
         app.logger.info(f"Sign up email was sent to User {new_user.username}")
         db.session.commit()
-        app.logger.info(f"User {new_user.username} signed up")
+        # the committed user is expired, logging its attribute would reload it
+        app.logger.info(f"User {data.get('username')} signed up")
         return {
             "message": "User successfully created",
             "data": marshal(user, user_base_model),
@@ -148,26 +151,20 @@ class Login(Resource):
 
         # checks if password matches
         if user and check_password_hash(user.password, data.get("password")):
+            # the claims loader reuses the user loaded here
+            claims = user_claims.remember(user)
+            is_administrator = {"is_administrator": claims["is_administrator"]}
+            access_token = create_access_token(
+                identity=user.id, fresh=True, additional_claims=is_administrator
+            )
+            refresh_token = create_refresh_token(
+                identity=user.id, additional_claims=is_administrator
+            )
+
             # checks if user is an admin
             if user.is_admin:
-                access_token = create_access_token(
-                    identity=user.id,
-                    fresh=True,
-                    additional_claims={"is_administrator": True},
-                )
-                refresh_token = create_refresh_token(
-                    identity=user.id, additional_claims={"is_administrator": True}
-                )
                 app.logger.info(f"Admin {user.username} logged in")
             else:
-                access_token = create_access_token(
-                    identity=user.id,
-                    fresh=True,
-                    additional_claims={"is_administrator": False},
-                )
-                refresh_token = create_refresh_token(
-                    identity=user.id, additional_claims={"is_administrator": False}
-                )
                 app.logger.info(f"User {user.username} logged in")
             return {
                 "access_token": access_token,
@@ -186,11 +183,16 @@ class Logout(Resource):
         """
         Logout a user and blacklist jwt token
         """
-        jti = get_jwt()["jti"]
-        user = User.get_by_id(get_jwt_identity())
-        token = TokenBlocklist(jti=jti, created_at=datetime.now(timezone.utc))
+        jwt = get_jwt()
+        user = User.get_current()
+        token = TokenBlocklist(
+            jti=jwt["jti"],
+            created_at=datetime.now(timezone.utc),
+            expires_at=datetime.fromtimestamp(jwt["exp"], timezone.utc),
+        )
         db.session.add(token)
         db.session.commit()
+        revoked_tokens.add(jwt["jti"], jwt["exp"])
         app.logger.info(f"{user.username} logged out")
         return {"message": "User successfully logged out"}
 
@@ -206,17 +208,17 @@ class Refresh(Resource):
         user_id = get_jwt_identity()
         user = User.get_by_id(user_id)
 
+        # the claims loader reuses the user loaded here
+        claims = user_claims.remember(user)
+        access_token = create_access_token(
+            identity=user_id,
+            fresh=False,
+            additional_claims={"is_administrator": claims["is_administrator"]},
+        )
+
         # checks if user is an admin
         if user.is_admin:
-            access_token = create_access_token(
-                identity=user_id,
-                fresh=False,
-                additional_claims={"is_administrator": True},
-            )
             app.logger.info(f"Admin {user.username} got a jwt refresh token")
             return {"access_token": access_token}, HTTPStatus.OK
-        access_token = create_access_token(
-            identity=user_id, fresh=False, additional_claims={"is_administrator": False}
-        )
         app.logger.info(f"User {user.username} got a jwt refresh token")
         return {"access_token": access_token}, HTTPStatus.OK
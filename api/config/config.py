@@ -25,8 +25,63 @@ class Config:
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
+    MAIL_QUEUE_SIZE = 1000
+    MAIL_QUEUE_TIMEOUT = 1
+    MAIL_WORKERS = 2
+    MAIL_BATCH_SIZE = 50
+    MAIL_MAX_RETRIES = 3
+    MAIL_RETRY_BACKOFF = 1
     SECURITY_PASSWORD_SALT = config("SECURITY_PASSWORD_SALT", "secure-password-salt")
-    CACHE_TYPE = "simple"
+    CACHE_TYPE = config("CACHE_TYPE", "SimpleCache")
+    CACHE_REDIS_URL = config("CACHE_REDIS_URL", None)
+    RATELIMIT_SYNC_INTERVAL = 1
+    RATELIMIT_SYNC_THRESHOLD = 0.8
+    # gunicorn reads the worker count from WEB_CONCURRENCY too
+    RATELIMIT_WORKERS = config("WEB_CONCURRENCY", 1, cast=int)
+    RATELIMIT_LOCAL_MIN_LIMIT = 100
+    RATELIMIT_BREAKER_FAILURES = 3
+    RATELIMIT_BREAKER_SLOW_CALL = 0.25
+    RATELIMIT_BREAKER_PROBE_INTERVAL = 5
+    CLICK_FLUSH_INTERVAL = 5
+    CLICK_BUFFER_SIZE = 1000
+    REDIRECT_STATUS_CODE = 302
+    REDIRECT_CACHE_SIZE = 10000
+    REDIRECT_CACHE_TTL = 10
+    REDIRECT_MISS_TTL = 5
+    REDIRECT_RATE_LIMIT = "10/minute"
+    KEY_POOL_BLOCK_SIZE = 100
+    KEY_POOL_LOW_WATER = 20
+    KEY_POOL_ASYNC_REFILL = True
+    KEY_POOL_RESERVE_ATTEMPTS = 5
+    KEY_INDEX_CAPACITY = 1_000_000
+    KEY_INDEX_FALSE_POSITIVE_RATE = 0.01
+    KEY_INDEX_REFRESH_INTERVAL = 30
+    KEY_INDEX_SNAPSHOT = os.path.join(BASE_DIR, "key_index.bloom")
+    URL_BATCH_LIMIT = 1000
+    URL_INSERT_ATTEMPTS = 3
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+    QRCODE_CACHE_SIZE = 512
+    QRCODE_CACHE_TIMEOUT = 86400
+    QRCODE_MAX_AGE = 3600
+    QRCODE_WORKERS = os.cpu_count()
+    QRCODE_BATCH_LIMIT = 1000
+    REVOCATION_SYNC_INTERVAL = 5
+    SUPER_ADMIN_EMAIL = config("EMAIL", None)
+    CLAIMS_CACHE_SIZE = 10000
+    CLAIMS_CACHE_TTL = 300
+    CLICK_EVENTS_BUFFER_SIZE = 10000
+    CLICK_EVENTS_BATCH_SIZE = 1000
+    CLICK_EVENTS_FLUSH_INTERVAL = 1
+    STATS_MAX_BUCKETS = 1000
+    METRICS_DIR = config("METRICS_DIR", None)
+    METRICS_SYNC_INTERVAL = 5
+    QUERY_REPEAT_THRESHOLD = 5
+    HOT_KEYS_CAPACITY = 200
+    HOT_KEYS_BUCKET_SECONDS = 60
+    HOT_KEYS_BUCKETS = 60
+    HOT_KEYS_SYNC_INTERVAL = 5
+    HOT_KEYS_REDIS_URL = config("HOT_KEYS_REDIS_URL", None)
     # STRIPE_SECRET_KEY = config("STRIPE_SECRET_KEY")
     # STRIPE_PUBLISHABLE_KEY = config("STRIPE_PUBLISHABLE_KEY")
 
@@ -42,6 +97,16 @@ class TestConfig(Config):
     SQLALCHEMY_ECHO = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = "sqlite://"
+    CLICK_FLUSH_INTERVAL = 0
+    KEY_POOL_ASYNC_REFILL = False
+    KEY_INDEX_SNAPSHOT = None
+    KEY_INDEX_WARM_ON_START = False
+    QRCODE_WORKERS = 2
+    CLICK_EVENTS_FLUSH_INTERVAL = 0
+    HOT_KEYS_SYNC_INTERVAL = 0
+    HOT_KEYS_REDIS_URL = None
+    # the limiter storage outlives each test's app
+    REDIRECT_RATE_LIMIT = None
 
 
 class ProductionConfig(Config):
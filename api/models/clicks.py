@@ -0,0 +1,44 @@
+from ..utils import db
+
+
+class ClickEvent(db.Model):
+    __tablename__ = "click_events"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    url_key = db.Column(db.String, nullable=False, index=True)
+    clicked_at = db.Column(db.DateTime, nullable=False, index=True)
+    referrer = db.Column(db.String(255), nullable=True)
+    user_agent_hash = db.Column(db.String(16), nullable=True)
+    ip_prefix = db.Column(db.String(43), nullable=True)
+
+    def __repr__(self):
+        return f"<ClickEvent {self.url_key}>"
+
+
+class HourlyClicks(db.Model):
+    __tablename__ = "click_rollups_hourly"
+    url_key = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<HourlyClicks {self.url_key} {self.bucket}>"
+
+
+class DailyClicks(db.Model):
+    __tablename__ = "click_rollups_daily"
+    url_key = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DailyClicks {self.url_key} {self.bucket}>"
+
+
+class DailyVisitors(db.Model):
+    __tablename__ = "visitor_sketches_daily"
+    url_key = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    visitors = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<DailyVisitors {self.url_key} {self.bucket}>"
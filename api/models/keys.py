@@ -0,0 +1,12 @@
+from ..utils import db
+from datetime import datetime
+
+
+class ReservedKey(db.Model):
+    __tablename__ = "reserved_keys"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    key = db.Column(db.String, nullable=False, unique=True, index=True)
+    reserved_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ReservedKey {self.key}>"
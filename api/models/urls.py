@@ -1,15 +1,22 @@
 from ..utils import db
+from ..utils.cache import collect_tags
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import deferred
 
 
 class Url(db.Model):
     __tablename__ = "urls"
+    __table_args__ = (db.Index("ix_urls_user_id_id", "user_id", "id"),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), nullable=True)
     key = db.Column(db.String, unique=True, index=True)
     target_url = db.Column(db.String, index=True)
     is_active = db.Column(db.Boolean, default=True)
     clicks = db.Column(db.Integer, default=0)
+    unique_visitors = db.Column(db.Integer, default=0)
+    # compressed HyperLogLog registers, only loaded when asked for
+    visitors = deferred(db.Column(db.LargeBinary, nullable=True))
     date_created = db.Column(db.DateTime, default=datetime.utcnow())
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
 
@@ -26,3 +33,10 @@ class Url(db.Model):
         A function to get a url instance by key
         """
         return cls.query.filter_by(key=key).first()
+
+
+@event.listens_for(Url, "after_insert")
+@event.listens_for(Url, "after_update")
+@event.listens_for(Url, "after_delete")
+def invalidate_url_views(mapper, connection, target):
+    collect_tags(target, f"url:{target.key}", f"user:{target.user_id}")
@@ -1,9 +1,12 @@
 from ..utils import db
+from ..utils.cache import collect_tags
 from datetime import datetime
+from sqlalchemy import event
 import jwt
+from flask_jwt_extended import get_jwt_identity
 from time import time
 import os
-from flask import current_app as app
+from flask import current_app as app, g, has_request_context
 
 
 class User(db.Model):
@@ -44,7 +47,22 @@ class User(db.Model):
 
     @classmethod
     def get_by_id(cls, id):
-        return cls.query.get_or_404(id)
+        """
+        Gets a user by id. Within a request each user is loaded only once
+        """
+        if not has_request_context():
+            return cls.query.get_or_404(id)
+        users = g.setdefault("users", {})
+        if id not in users:
+            users[id] = cls.query.get_or_404(id)
+        return users[id]
+
+    @classmethod
+    def get_current(cls):
+        """
+        Gets the user whose id is the identity of the request's jwt
+        """
+        return cls.get_by_id(get_jwt_identity())
 
     def get_reset_token(self, expires=86400):
         return jwt.encode(
@@ -61,3 +79,10 @@ class User(db.Model):
             app.logger.info(e)
             return
         return User.query.filter_by(username=username).first()
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user_views(mapper, connection, target):
+    collect_tags(target, f"user:{target.id}", "users")
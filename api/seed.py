@@ -0,0 +1,190 @@
+import click
+import json
+import random
+import string
+from itertools import accumulate
+from time import perf_counter
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+from .models.urls import Url
+from .models.users import User
+from .utils import db, invalidate, key_index
+
+KEY_ALPHABET = string.digits + string.ascii_letters
+KEY_LENGTH = 7
+# odd and not a multiple of 31, so n -> n * KEY_MULTIPLIER is a permutation
+# of the keys of KEY_LENGTH characters
+KEY_MULTIPLIER = 2654435761
+
+
+def zipf_weights(n, skew):
+    """
+    Cumulative weights of ranks 1 to n where rank k is drawn in proportion to
+    1 / k ** skew. A skew of 0 is uniform
+    """
+    return list(accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+def zipf_sample(rng, population, cum_weights, k):
+    return rng.choices(population, cum_weights=cum_weights, k=k)
+
+
+def seed_key(n, seed):
+    """
+    The url key of the nth seeded url, unique for every n below 62 ** 7
+    """
+    number = (n * KEY_MULTIPLIER + seed) % len(KEY_ALPHABET) ** KEY_LENGTH
+    key = []
+    for _ in range(KEY_LENGTH):
+        number, digit = divmod(number, len(KEY_ALPHABET))
+        key.append(KEY_ALPHABET[digit])
+    return "".join(key)
+
+
+def batches(count, size):
+    for start in range(0, count, size):
+        yield start, min(size, count - start)
+
+
+@click.command("seed")
+@click.option("--users", default=1000, show_default=True, help="Users to create.")
+@click.option("--urls", default=10000, show_default=True, help="Urls to create.")
+@click.option(
+    "--clicks",
+    default=100000,
+    show_default=True,
+    help="Clicks in the traffic trace, also counted on the urls.",
+)
+@click.option(
+    "--owner-skew",
+    default=1.1,
+    show_default=True,
+    help="Zipf exponent of how many urls each user owns, 0 for uniform.",
+)
+@click.option(
+    "--click-skew",
+    default=1.1,
+    show_default=True,
+    help="Zipf exponent of how many clicks each url gets, 0 for uniform.",
+)
+@click.option("--rate", default=100.0, show_default=True, help="Trace requests/s.")
+@click.option("--seed", default=0, show_default=True, help="Random seed.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows per insert.")
+@click.option(
+    "--trace",
+    type=click.File("w"),
+    help="Write the clicks as an ndjson traffic trace to replay.",
+)
+@click.option("--password", default="password", show_default=True)
+@with_appcontext
+def seed_command(
+    users,
+    urls,
+    clicks,
+    owner_skew,
+    click_skew,
+    rate,
+    seed,
+    batch_size,
+    trace,
+    password,
+):
+    """
+    Fill the database with a synthetic dataset of users and urls.
+
+    Url ownership and clicks follow Zipf distributions, so a few users own
+    most urls and a few urls get most clicks. Runs with the same options and
+    seed create the same dataset and trace. Every trace line is a redirect
+    request {"at": seconds from the start, "method": "GET", "path": "/<key>"}.
+    """
+    if urls and not users:
+        raise click.UsageError("Urls need at least one user to own them")
+    if clicks and not urls:
+        raise click.UsageError("Clicks need at least one url")
+    rng = random.Random(seed)
+    prefix = f"seed{seed}-"
+    if db.session.execute(
+        db.select(User.id).where(User.username == f"{prefix}0")
+    ).first():
+        raise click.UsageError(f"The database is already seeded with --seed {seed}")
+
+    started = perf_counter()
+    # hashing is deliberately slow, every user shares one hash
+    password = generate_password_hash(password)
+    for start, size in batches(users, batch_size):
+        db.session.execute(
+            db.insert(User),
+            [
+                {
+                    "first_name": "Seed",
+                    "last_name": f"User{n}",
+                    "username": f"{prefix}{n}",
+                    "email": f"{prefix}{n}@example.com",
+                    "password": password,
+                    "confirmed": True,
+                }
+                for n in range(start, start + size)
+            ],
+        )
+        db.session.commit()
+    user_ids = (
+        db.session.execute(
+            db.select(User.id)
+            .where(User.username.startswith(prefix, autoescape=True))
+            .order_by(User.id)
+        )
+        .scalars()
+        .all()
+    )
+    click.echo(f"{len(user_ids)} users ({perf_counter() - started:.1f}s)")
+
+    # ranks are shuffled so the busiest users and urls are not the first rows
+    rng.shuffle(user_ids)
+    url_ranks = list(range(urls))
+    rng.shuffle(url_ranks)
+
+    counts = [0] * urls
+    at = 0.0
+    # its own generator, so the dataset is the same with or without a trace
+    arrivals = random.Random(f"{seed}-arrivals")
+    cum_weights = zipf_weights(urls, click_skew)
+    for _, size in batches(clicks, batch_size):
+        ranks = zipf_sample(rng, url_ranks, cum_weights, size)
+        for n in ranks:
+            counts[n] += 1
+        if trace is not None:
+            lines = []
+            for n in ranks:
+                at += arrivals.expovariate(rate)
+                request = {"at": round(at, 6), "method": "GET"}
+                request["path"] = f"/{seed_key(n, seed)}"
+                lines.append(json.dumps(request))
+            trace.write("\n".join(lines) + "\n")
+
+    cum_weights = zipf_weights(len(user_ids), owner_skew)
+    for start, size in batches(urls, batch_size):
+        owners = zipf_sample(rng, user_ids, cum_weights, size)
+        db.session.execute(
+            db.insert(Url),
+            [
+                {
+                    "name": f"Seed {n}",
+                    "key": seed_key(n, seed),
+                    "target_url": f"https://example.com/{seed}/{n}",
+                    "user_id": owner,
+                    "clicks": counts[n],
+                    "is_active": True,
+                }
+                for n, owner in zip(range(start, start + size), owners)
+            ],
+        )
+        db.session.commit()
+        elapsed = perf_counter() - started
+        click.echo(f"{start + size} urls ({elapsed:.1f}s)")
+
+    key_index.rebuild()
+    invalidate("users")
+    click.echo(
+        f"Seeded {len(user_ids)} users, {urls} urls and {clicks} clicks "
+        f"in {perf_counter() - started:.1f}s"
+    )
@@ -1,9 +1,18 @@
+import logging
+import queue
+import socket
 import unittest
+from aiosmtpd.controller import Controller
+from flask_mail import Message
 from ..config import config_dict
-from ..utils import db
+from ..utils import db, mail, mail_queue, query_budget, user_claims
+from ..utils.logs import DroppingQueueHandler, JSONFormatter, RequestContextFilter
 from .. import create_app
 from flask_jwt_extended import create_refresh_token, create_access_token
 from ..models.users import User
+from ..models.blocklist import TokenBlocklist
+from flask_jwt_extended import decode_token
+from datetime import datetime, timezone
 
 
 class AuthenticationTestCase(unittest.TestCase):
@@ -88,3 +97,178 @@ class AuthenticationTestCase(unittest.TestCase):
         response = self.client.delete("logout", headers=header)
         assert response.status_code == 200
         assert response.json == {"message": "User successfully logged out"}
+
+        response = self.client.delete("logout", headers=header)
+        assert response.status_code == 401
+
+    def test_token_revoked_by_another_worker(self):
+        admin_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+
+        self.client.post("signup", json=admin_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_refresh_token(identity=admin.id)
+        header = {"Authorization": f"Bearer {token}"}
+
+        response = self.client.post("refresh", headers=header)
+        assert response.status_code == 200
+
+        # another worker logs the token out
+        payload = decode_token(token)
+        db.session.add(
+            TokenBlocklist(
+                jti=payload["jti"],
+                created_at=datetime.now(timezone.utc),
+                expires_at=datetime.fromtimestamp(payload["exp"], timezone.utc),
+            )
+        )
+        db.session.commit()
+        self.app.config["REVOCATION_SYNC_INTERVAL"] = 0
+
+        response = self.client.post("refresh", headers=header)
+        assert response.status_code == 401
+
+    def test_claims_follow_admin_changes(self):
+        admin_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+
+        self.client.post("signup", json=admin_signup_data)
+
+        user_login_data = {
+            "email": "testadmin@gmail.com",
+            "password": "password",
+        }
+        response = self.client.post("login", json=user_login_data)
+        token = decode_token(response.json["access_token"])
+
+        assert token["is_administrator"] == False
+        assert token["super_admin"] == False
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+        admin.make_admin()
+
+        assert user_claims.claims_for(admin.id)["is_administrator"] == True
+
+    def test_request_logging(self):
+        response = self.client.post("login", json={}, headers={"X-Request-ID": "req-1"})
+
+        assert response.headers["X-Request-ID"] == "req-1"
+
+        records = []
+        handler = DroppingQueueHandler(queue.Queue(1))
+        handler.addFilter(RequestContextFilter())
+        with self.app.test_request_context("/login", method="POST"):
+            self.app.preprocess_request()
+            handler.handle(logging.makeLogRecord({"msg": "first"}))
+            handler.handle(logging.makeLogRecord({"msg": "second"}))
+            records.append(handler.queue.get_nowait())
+
+        assert handler.dropped == 1
+        line = JSONFormatter().format(records[0])
+        assert '"message": "first"' in line
+        assert '"route": "/login"' in line
+        assert '"latency_ms"' in line
+
+    def test_user_signup_query_budget(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+
+        # one lookup for the email and username, one insert
+        with query_budget(2, table="users"):
+            response = self.client.post("signup", json=user_signup_data)
+
+        assert response.status_code == 201
+
+        user_signup_data["email"] = "other@gmail.com"
+        with query_budget(1, table="users"):
+            response = self.client.post("signup", json=user_signup_data)
+
+        assert response.status_code == 409
+        assert response.json == {"message": "Username already in use"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MailHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class MailQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handler = MailHandler()
+        self.smtpd = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.smtpd.start()
+
+        class MailConfig(config_dict["test"]):
+            MAIL_SERVER = "127.0.0.1"
+            MAIL_PORT = self.smtpd.port
+            MAIL_USE_TLS = False
+            MAIL_SUPPRESS_SEND = False
+            MAIL_RETRY_BACKOFF = 0.01
+            MAIL_MAX_RETRIES = 2
+
+        self.app = create_app(config=MailConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        self.client = self.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.drop_all()
+        self.appctx.pop()
+        self.smtpd.stop()
+        self.app = None
+        self.client = None
+
+    def test_signup_email_delivery(self):
+        for n in range(5):
+            user_signup_data = {
+                "first_name": "Test",
+                "last_name": "User",
+                "email": f"testuser{n}@gmail.com",
+                "username": f"user{n}",
+                "password": "password",
+            }
+            response = self.client.post("signup", json=user_signup_data)
+            assert response.status_code == 201
+
+        assert mail_queue.join(timeout=10)
+        assert len(self.handler.messages) == 5
+        assert mail_queue.metrics()["sent"] == 5
+        assert mail_queue.metrics()["depth"] == 0
+
+        # nothing listens on a freshly closed port
+        self.app.extensions["mail"].port = free_port()
+        mail_queue.send(
+            Message("Lost", sender="noreply@demo.com", recipients=["a@b.com"])
+        )
+
+        assert mail_queue.join(timeout=10)
+        assert mail_queue.metrics()["failed"] == 1
+        assert mail_queue.metrics()["retried"] == 2
@@ -1,10 +1,35 @@
+import io
+import json
+import os
+import tempfile
+import time
 import unittest
+import zipfile
+from unittest import mock
 from ..config import config_dict
-from ..utils import db
+from limits import parse
+from limits.storage import MemoryStorage
+from ..utils.hotkeys import SpaceSaving
+from ..utils.keypool import KeyPoolExhausted
+from ..urls.redirect import missing_keys
+from ..utils.limiter import HybridFixedWindowRateLimiter
+from ..utils import (
+    db,
+    click_counter,
+    click_events,
+    hot_keys,
+    key_pool,
+    key_index,
+    metrics,
+    count_queries,
+    url_key_taken,
+)
 from .. import create_app
 from flask_jwt_extended import create_access_token
 from ..models.users import User
 from ..models.urls import Url
+from ..models.keys import ReservedKey
+from ..models.clicks import ClickEvent
 
 
 class URLTestCase(unittest.TestCase):
@@ -74,6 +99,7 @@ class URLTestCase(unittest.TestCase):
         assert response.json == None
 
         assert response.status_code == 302  # Redirect status code
+        assert response.headers["Location"] == "https://www.google.com/"
 
     def test_url_delete(self):
         user_signup_data = {
@@ -104,6 +130,10 @@ class URLTestCase(unittest.TestCase):
         assert response.json == {"message": "Url has been deleted"}
         assert response.status_code == 200
 
+        response = self.client.get(f"{url.key}")
+
+        assert response.status_code != 302
+
     def test_qrcode(self):
         user_signup_data = {
             "first_name": "Test",
@@ -133,3 +163,628 @@ class URLTestCase(unittest.TestCase):
 
         assert response.json == None
         assert response.status_code == 200
+
+        response = self.client.get(f"{url.key}/qrcode?format=svg&fill=%23000000")
+
+        assert response.status_code == 200
+        assert response.mimetype == "image/svg+xml"
+        assert b"#000000" in response.data
+
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            f"{url.key}/qrcode?format=svg&fill=%23000000",
+            headers={"If-None-Match": etag},
+        )
+
+        assert response.status_code == 304
+
+        response = self.client.get(f"{url.key}/qrcode?format=gif")
+
+        assert response.status_code == 400
+
+        response = self.client.get(f"{url.key}/qrcode?fill=zzz")
+
+        assert response.status_code == 400
+
+    def test_url_click(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        url_post_data = {
+            "name": "Google",
+            "target url": "https://www.google.com/",
+        }
+
+        self.client.post("/create", headers=headers, json=url_post_data)
+
+        url = Url.query.get_or_404(1)
+
+        self.client.put(f"{url.key}/click")
+        response = self.client.put(f"{url.key}/click")
+
+        assert response.status_code == 200
+        assert response.json["clicks"] == 2
+
+        click_counter.flush()
+        db.session.refresh(url)
+
+        assert url.clicks == 2
+        assert click_counter.pending(url.key) == 0
+
+        # clicks stay pending until a flush commits them
+        click_counter.increment(url.key)
+        with mock.patch("api.utils.clicks.url_tags", side_effect=RuntimeError):
+            click_counter.flush()
+        db.session.refresh(url)
+
+        assert url.clicks == 2
+        assert click_counter.total(url) == 3
+
+        click_counter.flush()
+        db.session.refresh(url)
+
+        assert url.clicks == 3
+        assert click_counter.pending(url.key) == 0
+
+    def test_url_key_pool(self):
+        keys = key_pool.take(5, 3)
+
+        assert len(set(keys)) == 3
+        assert ReservedKey.query.filter(ReservedKey.key.in_(keys)).count() == 3
+        assert key_pool.depth(5) > 0
+
+        for key in keys:
+            assert url_key_taken(key)
+        assert not url_key_taken("free-key")
+
+        # one character keys run out after 36
+        key_pool.take(1, 36)
+        with self.assertRaises(KeyPoolExhausted):
+            key_pool.take(1, 1)
+
+    def test_url_post_reserved_key_taken(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        url_post_data = {
+            "name": "Google",
+            "target url": "https://www.google.com/",
+        }
+
+        # a paid user on another worker took the next reserved key as a custom key
+        key_pool.refill(5)
+        reserved = key_pool._keys[5][0]
+        Url(name="Taken", key=reserved, target_url="https://www.python.org/").save()
+
+        response = self.client.post("/create", headers=headers, json=url_post_data)
+
+        assert response.status_code == 201
+        assert not response.json["Short URL"].endswith(f"/{reserved}")
+        assert Url.query.count() == 2
+
+    def test_url_key_index(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+
+        assert key_index.might_contain("GOOGL")
+        assert not key_index.might_contain("never-used")
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.app.config["KEY_INDEX_SNAPSHOT"] = os.path.join(directory, "keys")
+            result = self.app.test_cli_runner().invoke(args=["urls", "rebuild-index"])
+
+            assert result.exit_code == 0
+            assert "Indexed 1 url keys" in result.output
+
+            key_index.filter = None
+            assert key_index.load()
+            assert key_index.might_contain("GOOGL")
+
+    def test_url_batch_post(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+        admin.paid = True
+        db.session.commit()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        url_post_data = [
+            {"name": "Google", "target url": "https://www.google.com/"},
+            {"name": "Python", "target url": "https://www.python.org/", "key": "py"},
+            {"name": "Again", "target url": "https://www.python.org/", "key": "py"},
+            {"name": "Invalid", "target url": "not a url"},
+            {"name": "Number", "target url": "https://www.python.org/", "key": 5},
+            {"name": "List", "target url": "https://www.python.org/", "key": ["a"]},
+        ]
+
+        response = self.client.post(
+            "/create/batch", headers=headers, json=url_post_data
+        )
+
+        assert response.status_code == 201
+
+        results = response.json["results"]
+
+        assert "Short URL" in results[0]
+        assert results[1]["Short URL"].endswith("/py")
+        assert results[2] == {"error": "Key is repeated in the batch"}
+        assert results[3] == {"error": "Your provided URL is not valid"}
+        assert results[4] == results[5] == {"error": "Key must be a non-empty string"}
+        assert Url.query.count() == 2
+
+        response = self.client.post(
+            "/create/batch", headers=headers, json=url_post_data[1:2]
+        )
+
+        assert response.status_code == 400
+        assert response.json["results"] == [{"error": "Key is taken"}]
+
+        # a key saved by another worker that the key index has not seen yet
+        db.session.execute(
+            db.insert(Url), [{"key": "raced", "target_url": "https://www.python.org/"}]
+        )
+        db.session.commit()
+        url_post_data = [
+            {"name": "Raced", "target url": "https://www.python.org/", "key": "raced"},
+            {"name": "Google", "target url": "https://www.google.com/"},
+        ]
+
+        response = self.client.post(
+            "/create/batch", headers=headers, json=url_post_data
+        )
+
+        assert response.status_code == 201
+        assert response.json["results"][0] == {"error": "Key is taken"}
+        assert "Short URL" in response.json["results"][1]
+
+    def test_url_import(self):
+        runner = self.app.test_cli_runner()
+        source = (
+            "key,target_url,name,clicks\n"
+            "imp1,https://www.google.com/,Google,4\n"
+            ",https://www.python.org/,Python,\n"
+            "imp2,not a url,Invalid,\n"
+            "imp3,https://www.python.org/,Python,many\n"
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "checkpoint")
+            result = runner.invoke(
+                args=[
+                    "urls",
+                    "import",
+                    "--chunk-size",
+                    "2",
+                    "--checkpoint",
+                    checkpoint,
+                ],
+                input=source,
+            )
+
+            assert result.exit_code == 0
+            assert "Finished: 2 imported, 2 skipped" in result.output
+            assert Url.get_by_key("imp1").clicks == 4
+            assert Url.query.count() == 2
+
+            result = runner.invoke(
+                args=["urls", "import", "--checkpoint", checkpoint], input=source
+            )
+
+            assert "Resuming after 4 rows" in result.output
+            assert Url.query.count() == 2
+
+        source = (
+            '{"key": "imp4", "target_url": "https://www.google.com/"}\n'
+            '{"key": "imp5", "target_url": \n'
+            '["https://www.google.com/"]\n'
+            '{"target_url": "https://www.google.com/", "user_id": 999}\n'
+            '{"key": 5, "target_url": "https://www.google.com/"}\n'
+        )
+        result = runner.invoke(
+            args=["urls", "import", "--format", "ndjson"], input=source
+        )
+
+        assert result.exit_code == 0
+        assert "Finished: 1 imported, 4 skipped" in result.output
+        assert Url.query.count() == 3
+
+    def test_seed(self):
+        runner = self.app.test_cli_runner()
+        args = ["seed", "--users", "20", "--urls", "300", "--clicks", "1000"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            trace = os.path.join(directory, "trace.ndjson")
+            result = runner.invoke(args=args + ["--seed", "7", "--trace", trace])
+
+            assert result.exit_code == 0
+            assert "Seeded 20 users, 300 urls and 1000 clicks" in result.output
+            assert User.query.count() == 20
+            assert Url.query.count() == 300
+            assert db.session.scalar(db.select(db.func.sum(Url.clicks))) == 1000
+
+            with open(trace) as file:
+                requests = [json.loads(line) for line in file]
+            assert len(requests) == 1000
+            assert requests[0]["at"] < requests[-1]["at"]
+            busiest = max(Url.query.all(), key=lambda url: url.clicks)
+            assert busiest.clicks == sum(
+                request["path"] == f"/{busiest.key}" for request in requests
+            )
+            # a few urls get most of the clicks
+            assert busiest.clicks > 1000 / 300 * 10
+
+            result = runner.invoke(args=args + ["--seed", "7"])
+            assert "already seeded" in result.output
+
+            db.drop_all()
+            db.create_all()
+            runner.invoke(args=args + ["--seed", "7", "--trace", trace])
+            with open(trace) as file:
+                assert [json.loads(line) for line in file] == requests
+
+    def test_qrcode_batch(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        url_post_data = [
+            {"name": "Google", "target url": "https://www.google.com/"},
+            {"name": "Python", "target url": "https://www.python.org/"},
+        ]
+
+        self.client.post("/create/batch", headers=headers, json=url_post_data)
+
+        response = self.client.post(
+            "qrcodes?format=svg", headers=headers, json={"user_id": admin.id}
+        )
+
+        assert response.status_code == 200
+        assert response.mimetype == "application/zip"
+
+        keys = [url.key for url in Url.query.order_by(Url.id)]
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+
+        assert archive.namelist() == [f"{key}.svg" for key in keys]
+        assert archive.read(f"{keys[0]}.svg").startswith(b"<?xml")
+
+        response = self.client.post("qrcodes", headers=headers, json=keys)
+
+        assert response.status_code == 400
+
+    def test_redirect_click_events(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+
+        response = self.client.get(
+            "GOOGL",
+            headers={"Referer": "https://news.example/", "User-Agent": "test"},
+            environ_base={"REMOTE_ADDR": "203.0.113.77"},
+        )
+
+        assert response.status_code == 302
+        assert ClickEvent.query.count() == 0
+
+        click_events.drain()
+        event = ClickEvent.query.one()
+
+        assert event.url_key == "GOOGL"
+        assert event.referrer == "https://news.example/"
+        assert event.ip_prefix == "203.0.113.0/24"
+        assert len(event.user_agent_hash) == 16
+
+        self.app.config["CLICK_EVENTS_BUFFER_SIZE"] = 0
+        dropped = click_events.dropped
+        self.client.get("GOOGL")
+
+        assert click_events.dropped == dropped + 1
+
+    def test_redirect_missing_key_cached(self):
+        response = self.client.get("LATER")
+
+        assert response.status_code != 302
+        assert missing_keys.get("LATER")
+
+        with count_queries("urls") as queries:
+            self.client.get("LATER")
+
+        # neither the middleware nor the cached url view looked it up again
+        assert queries.count == 0
+
+        Url(name="Later", key="LATER", target_url="https://www.google.com/").save()
+        response = self.client.get("LATER")
+
+        assert response.status_code == 302
+
+    def test_redirect_rate_limit(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+        self.app.wsgi_app.rate_limit = parse("2/minute")
+        environ = {"REMOTE_ADDR": "198.51.100.7"}
+
+        for _ in range(2):
+            response = self.client.get("GOOGL", environ_base=environ)
+
+            assert response.status_code == 302
+
+        response = self.client.get("GOOGL", environ_base=environ)
+
+        assert response.status_code == 429
+
+    def test_url_stats(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+
+        for _ in range(3):
+            self.client.get("GOOGL")
+        click_events.drain()
+
+        response = self.client.get("GOOGL/stats?granularity=hour")
+
+        assert response.status_code == 200
+        assert response.json["total"] == 3
+        assert len(response.json["buckets"]) == 25
+        assert response.json["buckets"][-1]["clicks"] == 3
+
+        response = self.client.get(
+            "GOOGL/stats", query_string={"from": "2020-01-01", "to": "2020-01-07"}
+        )
+
+        assert response.status_code == 200
+        assert response.json["total"] == 0
+        assert len(response.json["buckets"]) == 7
+
+        response = self.client.get(
+            "GOOGL/stats", query_string={"from": "2000-01-01", "granularity": "hour"}
+        )
+
+        assert response.status_code == 400
+
+    def test_hot_urls(self):
+        for key, clicks in (("GOOGL", 5), ("YAHOO", 3), ("BINGO", 1)):
+            Url(name=key, key=key, target_url="https://www.google.com/").save()
+            for _ in range(clicks):
+                self.client.get(key)
+        # another worker's sketch of the current bucket
+        other = SpaceSaving(self.app.config["HOT_KEYS_CAPACITY"])
+        other.add("YAHOO", 4)
+        hot_keys.store.publish(hot_keys._buckets[-1][0], "other", other.dumps(), 60)
+
+        response = self.client.get("urls/hot")
+
+        assert response.status_code == 401
+
+        signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=signup_data)
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+        token = create_access_token(
+            identity=admin.id, additional_claims={"is_administrator": True}
+        )
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = self.client.get("urls/hot?limit=2", headers=headers)
+
+        assert response.status_code == 200
+        assert [item["key"] for item in response.json["keys"]] == ["YAHOO", "GOOGL"]
+        assert response.json["keys"][0]["clicks"] == 7
+
+        sketch = SpaceSaving(2)
+        for key in ("a", "a", "a", "b", "c"):
+            sketch.add(key)
+
+        assert sketch.top(2) == [("a", 3, 0), ("c", 2, 1)]
+
+    def test_url_unique_visitors(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+
+        for visitor in range(50):
+            for _ in range(2):
+                self.client.get(
+                    "GOOGL", environ_base={"REMOTE_ADDR": f"203.0.113.{visitor}"}
+                )
+        click_events.drain()
+
+        db.session.expire_all()
+
+        # sketches are compressed well below their 4096 registers
+        assert len(Url.get_by_key("GOOGL").visitors) < 4096
+
+        response = self.client.put("GOOGL/click")
+
+        assert abs(response.json["unique_visitors"] - 50) <= 2
+
+        response = self.client.get("GOOGL/stats")
+
+        assert response.json["total"] == 100
+        assert abs(response.json["unique_visitors"] - 50) <= 2
+
+        # a later batch merges into the day's stored sketch
+        for visitor in range(50, 75):
+            self.client.get(
+                "GOOGL", environ_base={"REMOTE_ADDR": f"203.0.113.{visitor}"}
+            )
+        click_events.drain()
+
+        response = self.client.get("GOOGL/stats")
+
+        assert response.json["total"] == 125
+        assert abs(response.json["unique_visitors"] - 75) <= 3
+
+    def test_hybrid_rate_limiter(self):
+        storage = MemoryStorage()
+        rate_limiter = HybridFixedWindowRateLimiter(storage)
+        limit = parse("100/minute")
+
+        for _ in range(50):
+            assert rate_limiter.hit(limit, "client")
+
+        # one sync opens the bucket, the next one is due once the interval passed
+        assert rate_limiter.syncs == 1
+        assert storage.get(limit.key_for("client")) == 1
+        assert rate_limiter.get_window_stats(limit, "client").remaining == 50
+
+        rate_limiter.sync_interval = 0
+        rate_limiter.hit(limit, "client")
+
+        assert storage.get(limit.key_for("client")) == 51
+
+        limit = parse("2/minute")
+
+        assert rate_limiter.hit(limit, "other")
+        assert rate_limiter.hit(limit, "other")
+        assert not rate_limiter.hit(limit, "other")
+
+        # low limits are always synced
+        syncs = rate_limiter.syncs
+        rate_limiter.sync_interval = 1
+        limit = parse("10/minute")
+        for _ in range(3):
+            rate_limiter.hit(limit, "low")
+
+        assert rate_limiter.syncs == syncs + 3
+
+        # four workers each take a quarter of the headroom locally
+        rate_limiter.workers = 4
+        limit = parse("1000/minute")
+        for _ in range(300):
+            rate_limiter.hit(limit, "shared")
+
+        assert storage.get(limit.key_for("shared")) > 100
+
+    def test_rate_limiter_circuit_breaker(self):
+        class FlakyStorage(MemoryStorage):
+            down = True
+
+            def incr(self, *args, **kwargs):
+                if self.down:
+                    raise ConnectionError("storage is down")
+                return super().incr(*args, **kwargs)
+
+            def check(self):
+                return not self.down
+
+        storage = FlakyStorage()
+        rate_limiter = HybridFixedWindowRateLimiter(storage)
+        rate_limiter.breaker.probe_interval = 0.01
+        limit = parse("2/minute")
+
+        # failed syncs fall back to the in-memory moving window
+        assert rate_limiter.hit(limit, "client")
+        assert rate_limiter.hit(limit, "client")
+        assert not rate_limiter.hit(limit, "client")
+        assert rate_limiter.breaker.metrics()["state"] == "open"
+
+        storage.down = False
+        for _ in range(100):
+            if rate_limiter.breaker.allow():
+                break
+            time.sleep(0.01)
+
+        assert rate_limiter.breaker.metrics()["state"] == "closed"
+        assert rate_limiter.hit(limit, "client")
+        assert storage.get(limit.key_for("client")) == 1
+
+    def test_metrics(self):
+        url = Url(name="Google", key="GOOGL", target_url="https://www.google.com/")
+        url.save()
+
+        self.client.get("GOOGL")
+        self.client.get("GOOGL/stats")
+
+        # a second worker sharing the metrics directory
+        with tempfile.TemporaryDirectory() as directory:
+            self.app.config["METRICS_DIR"] = directory
+            with open(os.path.join(directory, "1.json"), "w") as file:
+                json.dump(
+                    {
+                        "time": time.time(),
+                        "values": [
+                            [
+                                "http_requests_total",
+                                {
+                                    "method": "GET",
+                                    "route": "/<url_key>",
+                                    "status": "302",
+                                },
+                                2,
+                            ]
+                        ],
+                        "histograms": [],
+                    },
+                    file,
+                )
+            # a worker that exited long ago
+            dead = os.path.join(directory, "2.json")
+            with open(dead, "w") as file:
+                json.dump({"time": 0, "values": [], "histograms": []}, file)
+            os.utime(dead, (0, 0))
+            try:
+                response = self.client.get("metrics")
+            finally:
+                self.app.config["METRICS_DIR"] = None
+                metrics.stop_writer()
+
+            assert not os.path.exists(dead)
+        text = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert "# TYPE http_request_duration_seconds histogram" in text
+        assert (
+            'http_requests_total{method="GET",route="/<url_key>",status="302"} 3'
+            in text
+        )
+        assert (
+            'http_request_duration_seconds_count{method="GET",route="/<string:url_key>/stats"} 1'
+            in text
+        )
+        assert 'cache_requests_total{result="miss"}' in text
+        assert "mail_queue_depth 0" in text
+        assert "key_pool_depth" in text
+        assert "db_queries_total" in text
@@ -1,6 +1,7 @@
 import unittest
 from ..config import config_dict
-from ..utils import db
+from ..utils import db, click_counter, count_queries, query_budget, query_inspector
+from ..utils.queries import QueryBudgetExceeded
 from .. import create_app
 from flask_jwt_extended import create_access_token
 from ..models.users import User
@@ -41,7 +42,8 @@ class UserTestCase(unittest.TestCase):
 
         response = self.client.get("users", headers=headers)
         assert response.status_code == 200
-        assert len(response.json) == 1
+        assert len(response.json["data"]) == 1
+        assert response.json["next_cursor"] == None
 
     def test_get_user_by_id(self):
         admin_signup_data = {
@@ -139,11 +141,22 @@ class UserTestCase(unittest.TestCase):
 
         self.client.post("/create", headers=headers, json=url_post_data)
 
-        response = self.client.get("/user/1/urls", headers=headers)
+        self.client.post("/create", headers=headers, json=url_post_data)
+
+        response = self.client.get("/user/1/urls?limit=1", headers=headers)
 
         assert response.status_code == 200
 
-        assert len(response.json) == 1
+        assert len(response.json["data"]) == 1
+
+        cursor = response.json["next_cursor"]
+        response = self.client.get(
+            f"/user/1/urls?limit=1&after={cursor}", headers=headers
+        )
+
+        assert len(response.json["data"]) == 1
+        assert response.json["data"][0]["id"] == 2
+        assert response.json["next_cursor"] == None
 
     def test_revoke_paid(self):
         user_signup_data = {
@@ -221,3 +234,94 @@ class UserTestCase(unittest.TestCase):
         assert response.status_code == 498
 
         assert response.json == {"Error": "The reset token is invalid or has expired."}
+
+    def test_user_loaded_once_per_request(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+
+        db.session.expunge_all()
+        with count_queries("users") as queries:
+            response = self.client.get(f"/user/{admin.id}", headers=headers)
+
+        assert response.status_code == 200
+        assert queries.count == 1
+
+    def test_user_urls_cache_invalidated(self):
+        user_signup_data = {
+            "first_name": "Test",
+            "last_name": "Admin",
+            "email": "testadmin@gmail.com",
+            "username": "admin",
+            "password": "password",
+        }
+        self.client.post("signup", json=user_signup_data)
+
+        admin = User.query.filter_by(email="testadmin@gmail.com").first()
+
+        token = create_access_token(identity=admin.id)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        url_post_data = {
+            "name": "Google",
+            "target url": "https://www.google.com/",
+        }
+
+        self.client.post("/create", headers=headers, json=url_post_data)
+
+        response = self.client.get("/user/1/urls", headers=headers)
+
+        assert len(response.json["data"]) == 1
+
+        self.client.post("/create", headers=headers, json=url_post_data)
+
+        response = self.client.get("/user/1/urls", headers=headers)
+
+        assert len(response.json["data"]) == 2
+
+        key = response.json["data"][0]["key"]
+        click_counter.increment(key)
+        click_counter.flush()
+
+        response = self.client.get("/user/1/urls", headers=headers)
+
+        assert response.json["data"][0]["clicks"] == 1
+
+    def test_repeated_queries(self):
+        for n in range(5):
+            user = User(
+                first_name="Test",
+                last_name="User",
+                username=f"user{n}",
+                email=f"user{n}@gmail.com",
+                password="password",
+            )
+            db.session.add(user)
+        db.session.commit()
+        ids = [user.id for user in User.query.all()]
+        db.session.expunge_all()
+
+        with self.app.test_request_context("/users"):
+            self.app.preprocess_request()
+            for user_id in ids:
+                db.session.get(User, user_id)
+            self.app.process_response(self.app.response_class())
+
+        assert len(query_inspector.suspects) == 1
+
+        db.session.expunge_all()
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(10, max_repeats=1):
+                for user_id in ids:
+                    db.session.get(User, user_id)
@@ -0,0 +1,230 @@
+import click
+import csv
+import json
+import os
+import validators
+from itertools import islice
+from time import perf_counter
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+from ..models.urls import Url
+from ..models.users import User
+from ..utils import (
+    db,
+    invalidate,
+    key_index,
+    key_pool,
+    url_keys_taken,
+    url_keys_used,
+    qrcode_cache,
+    zip_stream,
+    QRCODE_MIMETYPES,
+)
+
+urls_cli = AppGroup("urls", help="Manage shortened urls.")
+
+
+@urls_cli.command("rebuild-index")
+def rebuild_index():
+    """
+    Rebuild the url key existence index and its snapshot
+    """
+    count = key_index.rebuild()
+    click.echo(f"Indexed {count} url keys")
+
+
+def read_records(source, file_format):
+    """
+    Lazily yields url records from a csv or ndjson file. A line that is not
+    a json object yields None, so it is skipped and still counted
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(source)
+        return
+    for line in source:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        return json.load(checkpoint)["rows"]
+
+
+def write_checkpoint(path, rows):
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as checkpoint:
+        json.dump({"rows": rows}, checkpoint)
+    os.replace(temporary, path)
+
+
+def import_chunk(records, default_user_id):
+    """
+    Inserts a chunk of url records. Returns the number of imported and skipped records
+    """
+    rows = []
+    custom_keys = set()
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        target_url = record.get("target_url") or record.get("target url")
+        if not isinstance(target_url, str) or not validators.url(target_url):
+            continue
+        try:
+            clicks = int(record.get("clicks") or 0)
+            user_id = int(record.get("user_id") or 0) or default_user_id
+        except (TypeError, ValueError):
+            continue
+        key = record.get("key") or None
+        if key is not None:
+            if not isinstance(key, str) or key in custom_keys:
+                continue
+            custom_keys.add(key)
+        rows.append(
+            {
+                "name": record.get("name") or None,
+                "key": key,
+                "target_url": target_url,
+                "clicks": clicks,
+                "user_id": user_id,
+            }
+        )
+
+    # rows of unknown users would fail the whole chunk on the foreign key
+    user_ids = {row["user_id"] for row in rows if row["user_id"] is not None}
+    if user_ids:
+        known = set(
+            db.session.execute(
+                db.select(User.id).where(User.id.in_(user_ids))
+            ).scalars()
+        )
+        rows = [
+            row for row in rows if row["user_id"] is None or row["user_id"] in known
+        ]
+        custom_keys = {row["key"] for row in rows if row["key"] is not None}
+
+    taken = url_keys_taken(custom_keys)
+    rows = [row for row in rows if row["key"] is None or row["key"] not in taken]
+    custom_keys -= taken
+    random_rows = [row for row in rows if row["key"] is None]
+    for row, key in zip(random_rows, key_pool.take(5, len(random_rows))):
+        row["key"] = key
+
+    for _ in range(current_app.config["URL_INSERT_ATTEMPTS"]):
+        try:
+            if rows:
+                db.session.execute(db.insert(Url), rows)
+            db.session.commit()
+        except IntegrityError as error:
+            # another writer took one of the keys after it was checked, and the
+            # key index may not know yet, so ask the database
+            db.session.rollback()
+            failure = error.orig
+            taken = url_keys_taken(custom_keys, exact=True)
+            rows = [row for row in rows if row["key"] not in taken]
+            custom_keys -= taken
+            used = url_keys_used({row["key"] for row in random_rows})
+            for row in random_rows:
+                if row["key"] in used:
+                    row["key"] = key_pool.get(5)
+            continue
+        key_index.add_many(custom_keys)
+        invalidate(*{f"user:{row['user_id']}" for row in rows})
+        return len(rows), len(records) - len(rows)
+    raise click.ClickException(f"A chunk of urls could not be saved: {failure}")
+
+
+@urls_cli.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "ndjson"]),
+    help="Format of the source. Guessed from the file extension by default.",
+)
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows per insert.")
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File that records progress so an interrupted import can be resumed.",
+)
+@click.option("--user-id", type=int, help="Owner of rows without a user_id.")
+def import_urls(source, file_format, chunk_size, checkpoint, user_id):
+    """
+    Import urls from a csv or ndjson file, or from stdin
+    """
+    if file_format is None:
+        file_format = "ndjson" if source.name.endswith((".ndjson", ".jsonl")) else "csv"
+
+    done = read_checkpoint(checkpoint)
+    records = islice(read_records(source, file_format), done, None)
+    if done:
+        click.echo(f"Resuming after {done} rows")
+
+    imported = skipped = 0
+    started = perf_counter()
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        chunk_imported, chunk_skipped = import_chunk(chunk, user_id)
+        imported += chunk_imported
+        skipped += chunk_skipped
+        done += len(chunk)
+        write_checkpoint(checkpoint, done)
+        elapsed = perf_counter() - started
+        click.echo(
+            f"{imported} imported, {skipped} skipped "
+            f"({(imported + skipped) / elapsed:.0f} rows/s)"
+        )
+
+    click.echo(f"Finished: {imported} imported, {skipped} skipped")
+
+
+@urls_cli.command("qrcodes")
+@click.argument("keys", nargs=-1)
+@click.option("--user-id", type=int, help="Export the qrcodes of every url of a user.")
+@click.option(
+    "--output",
+    type=click.File("wb"),
+    default="qrcodes.zip",
+    show_default=True,
+    help="Zip archive to write, or - for stdout.",
+)
+@click.option("--size", default=10, show_default=True, help="Box size in pixels.")
+@click.option("--fill", default="blue", show_default=True)
+@click.option("--back", default="white", show_default=True)
+@click.option(
+    "--format",
+    "image_format",
+    type=click.Choice(list(QRCODE_MIMETYPES)),
+    default="png",
+    show_default=True,
+)
+def export_qrcodes(keys, user_id, output, size, fill, back, image_format):
+    """
+    Export the qrcodes of url keys or of a user's urls as a zip archive
+    """
+    if user_id is not None:
+        condition = Url.user_id == user_id
+    elif keys:
+        condition = Url.key.in_(keys)
+    else:
+        raise click.UsageError("Provide url keys or --user-id")
+
+    urls = db.session.execute(
+        db.select(Url.key, Url.target_url).where(condition).order_by(Url.id)
+    ).all()
+    images = qrcode_cache.get_many(urls, size, fill, back, image_format)
+    files = ((f"{key}.{image_format}", image) for key, image in images)
+    for chunk in zip_stream(files):
+        output.write(chunk)
+    click.echo(f"Exported {len(urls)} qrcodes", err=True)
@@ -0,0 +1,143 @@
+from time import perf_counter
+from limits import parse
+from sqlalchemy import event, select
+from werkzeug.urls import iri_to_uri
+from ..models.urls import Url
+from ..utils import db, click_events, hot_keys, limiter, metrics
+from ..utils.lru import LRUCache
+
+redirect_cache = LRUCache()
+# keys found missing or inactive, so unknown paths do not query on every request
+missing_keys = LRUCache()
+
+# the route label of redirects in the metrics
+ROUTE = "/<url_key>"
+
+REDIRECT_STATUS_LINES = {301: "301 Moved Permanently", 302: "302 Found"}
+TOO_MANY_REQUESTS = "429 Too Many Requests"
+
+
+class RedirectMiddleware:
+    """
+    Serves short url redirects before a request reaches flask-restx.
+
+    GET and HEAD requests for a single path segment that is not one of the app's
+    own routes are resolved from an in-process LRU cache, falling back to a single
+    column lookup. Unknown or inactive keys are passed on to the wrapped app and
+    remembered for REDIRECT_MISS_TTL seconds. Each worker has its own caches, so
+    REDIRECT_CACHE_TTL bounds how long other workers keep redirecting a deleted
+    url. Requests are rate limited per client address by REDIRECT_RATE_LIMIT
+    through the app's limiter storage before any lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.status = REDIRECT_STATUS_LINES[app.config["REDIRECT_STATUS_CODE"]]
+        self._reserved = None
+        self.rate_limit = (
+            parse(app.config["REDIRECT_RATE_LIMIT"])
+            if app.config["REDIRECT_RATE_LIMIT"]
+            else None
+        )
+        redirect_cache.configure(
+            app.config["REDIRECT_CACHE_SIZE"], app.config["REDIRECT_CACHE_TTL"]
+        )
+        missing_keys.configure(
+            app.config["REDIRECT_CACHE_SIZE"], app.config["REDIRECT_MISS_TTL"]
+        )
+        missing_keys.clear()
+
+    def __call__(self, environ, start_response):
+        if environ["REQUEST_METHOD"] in ("GET", "HEAD"):
+            started = perf_counter()
+            url_key = self._url_key(environ.get("PATH_INFO", ""))
+            if url_key and not self.allowed(environ):
+                self._record(environ["REQUEST_METHOD"], started, "429")
+                body = b"Too Many Requests"
+                start_response(
+                    TOO_MANY_REQUESTS,
+                    [
+                        ("Content-Type", "text/plain"),
+                        ("Content-Length", str(len(body))),
+                    ],
+                )
+                return [body]
+            target_url = self.resolve(url_key) if url_key else None
+            if target_url:
+                click_events.emit(url_key, environ)
+                hot_keys.add(url_key)
+                self._record(environ["REQUEST_METHOD"], started, self.status[:3])
+                start_response(
+                    self.status,
+                    [
+                        ("Location", target_url),
+                        ("Content-Length", "0"),
+                        ("Cache-Control", "no-store"),
+                    ],
+                )
+                return [b""]
+        return self.wsgi_app(environ, start_response)
+
+    def resolve(self, url_key):
+        """
+        Returns the target url of an active url key
+        """
+        target_url = redirect_cache.get(url_key)
+        if target_url is None:
+            if missing_keys.get(url_key):
+                return None
+            with self.app.app_context():
+                target_url = db.session.execute(
+                    select(Url.target_url).where(
+                        Url.key == url_key, Url.is_active == True
+                    )
+                ).scalar()
+            if target_url is None:
+                missing_keys.set(url_key, True)
+                return None
+            target_url = iri_to_uri(target_url)
+            redirect_cache.set(url_key, target_url)
+        return target_url
+
+    def allowed(self, environ):
+        """
+        Takes a hit off the client's redirect rate limit
+        """
+        if self.rate_limit is None or not limiter.enabled:
+            return True
+        address = environ.get("REMOTE_ADDR") or "127.0.0.1"
+        return limiter.limiter.hit(self.rate_limit, "redirect", address)
+
+    def _record(self, method, started, status):
+        metrics.inc("http_requests_total", method=method, route=ROUTE, status=status)
+        metrics.observe(
+            "http_request_duration_seconds",
+            perf_counter() - started,
+            method=method,
+            route=ROUTE,
+        )
+
+    def _url_key(self, path):
+        url_key = path.strip("/")
+        if not url_key or "/" in url_key or url_key in self.reserved:
+            return None
+        return url_key
+
+    @property
+    def reserved(self):
+        # first path segments of the app's own routes, e.g. "users" or "swagger.json"
+        if self._reserved is None:
+            self._reserved = {
+                rule.rule.lstrip("/").split("/")[0]
+                for rule in self.app.url_map.iter_rules()
+                if "<" not in rule.rule.lstrip("/").split("/")[0]
+            }
+        return self._reserved
+
+
+@event.listens_for(Url, "after_insert")
+@event.listens_for(Url, "after_update")
+def forget_missing_key(mapper, connection, target):
+    if target.key is not None:
+        missing_keys.evict(target.key)
@@ -1,14 +1,45 @@
 from flask_restx import Namespace, Resource, fields, marshal
-from flask import abort, request, redirect, send_file
+from flask import (
+    Response,
+    abort,
+    request,
+    redirect,
+    send_file,
+    stream_with_context,
+)
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
 from ..models.users import User
 from ..models.urls import Url
+from ..models.clicks import DailyClicks, DailyVisitors, HourlyClicks
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from http import HTTPStatus
-from ..utils import db, generate_url_key, url_key_taken, cache, limiter
+from ..utils import (
+    db,
+    generate_url_key,
+    url_key_taken,
+    url_keys_taken,
+    url_keys_used,
+    key_pool,
+    key_index,
+    cached_view,
+    invalidate,
+    limiter,
+    click_counter,
+    hot_keys,
+    admin_required,
+    hour_bucket,
+    day_bucket,
+    HyperLogLog,
+    qrcode_cache,
+    valid_color,
+    QRCODE_MIMETYPES,
+    zip_stream,
+)
 import validators
-import qrcode
 import io
 from decouple import config as configuration
+from .redirect import missing_keys, redirect_cache
 
 from flask import current_app as app
 
@@ -22,13 +53,25 @@ url_model = url_namespace.model(
     },
 )
 
+url_batch_model = url_namespace.model(
+    "url_batch_item",
+    {
+        "target url": fields.String(required=True, description="Target URL"),
+        "name": fields.String(description="Name of shortened url"),
+        "key": fields.String(description="The new string for url. Paid users only"),
+    },
+)
+
 url_marshal_model = url_namespace.model(
     "url_data",
     {
         "name": fields.String(description="Name of shortened url"),
         "target_url": fields.String(description="Target URL"),
         "key": fields.String(description="The new string for url"),
-        "clicks": fields.Integer(),
+        "clicks": fields.Integer(attribute=lambda url: click_counter.total(url)),
+        "unique_visitors": fields.Integer(
+            default=0, description="Approximate number of distinct visitors"
+        ),
         "date_created": fields.DateTime(),
     },
 )
@@ -69,7 +112,12 @@ class CreateURLView(Resource):
                     target_url=data.get("target url"),
                 )
                 url.user_id = user_id
-                url.save()
+                try:
+                    url.save()
+                except IntegrityError:
+                    # another worker took the key after it was checked
+                    db.session.rollback()
+                    abort(400, "Key is taken")
                 app.logger.info(f"{user.username} shortened a url")
                 return {"Short URL": f"{DOMAIN + '/' + url.key}"}, HTTPStatus.CREATED
         url = Url(  # Implement not showing key option for a user who is not paid when developing the frontend
@@ -78,11 +126,113 @@ class CreateURLView(Resource):
             target_url=data.get("target url"),
         )
         url.user_id = user_id
-        url.save()
+        for _ in range(app.config["URL_INSERT_ATTEMPTS"]):
+            try:
+                url.save()
+                break
+            except IntegrityError:
+                # a paid user took the reserved key as a custom key before the
+                # key index of their worker knew it was reserved
+                db.session.rollback()
+                url.key = generate_url_key(5)
+        else:
+            abort(409, "The url could not be saved, try again")
         app.logger.info(f"{user.username} shortened a url")
         return {"Short URL": f"{DOMAIN + '/' + url.key}"}, HTTPStatus.CREATED
 
 
+@url_namespace.route("create/batch")
+class BatchCreateURLView(Resource):
+    @url_namespace.expect([url_batch_model])
+    @url_namespace.doc(
+        description="Shorten a list of urls in one request. Each url gets its own result"
+    )
+    @jwt_required()
+    def post(self):
+        """
+        Shorten a batch of urls
+        """
+        user_id = get_jwt_identity()
+        user = User.get_by_id(user_id)
+
+        data = request.get_json()
+
+        # validates the batch
+        if not isinstance(data, list) or not data:
+            abort(400, "Provide a list of urls")
+        if len(data) > app.config["URL_BATCH_LIMIT"]:
+            abort(
+                400, f"A batch can contain at most {app.config['URL_BATCH_LIMIT']} urls"
+            )
+
+        results = [None] * len(data)
+        custom_keys = {}
+        for index, item in enumerate(data):
+            if not isinstance(item, dict) or not validators.url(item.get("target url")):
+                results[index] = {"error": "Your provided URL is not valid"}
+                continue
+            # only paid users can customize their url key
+            key = item.get("key") if user.paid else None
+            if key is not None:
+                if not isinstance(key, str) or not key:
+                    results[index] = {"error": "Key must be a non-empty string"}
+                    continue
+                if key in custom_keys:
+                    results[index] = {"error": "Key is repeated in the batch"}
+                    continue
+                custom_keys[key] = index
+
+        for key in url_keys_taken(custom_keys):
+            results[custom_keys.pop(key)] = {"error": "Key is taken"}
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        keys = {index: key for key, index in custom_keys.items()}
+        random_indexes = [index for index in pending if index not in keys]
+        keys.update(zip(random_indexes, key_pool.take(5, len(random_indexes))))
+
+        for _ in range(app.config["URL_INSERT_ATTEMPTS"]):
+            rows = [
+                {
+                    "name": data[index].get("name"),
+                    "key": keys[index],
+                    "target_url": data[index].get("target url"),
+                    "user_id": user_id,
+                }
+                for index in pending
+            ]
+            if not rows:
+                break
+            try:
+                db.session.execute(db.insert(Url), rows)
+                db.session.commit()
+            except IntegrityError:
+                # another worker took one of the keys after it was checked, and
+                # the key index may not know yet, so ask the database
+                db.session.rollback()
+                for key in url_keys_taken(custom_keys, exact=True):
+                    index = custom_keys.pop(key)
+                    results[index] = {"error": "Key is taken"}
+                    pending.remove(index)
+                random_keys = {keys[index]: index for index in random_indexes}
+                for key in url_keys_used(random_keys):
+                    keys[random_keys[key]] = key_pool.get(5)
+                continue
+            key_index.add_many(custom_keys)
+            for key in custom_keys:
+                missing_keys.evict(key)
+            invalidate(f"user:{user_id}")
+            for index, row in zip(pending, rows):
+                results[index] = {"Short URL": f"{DOMAIN + '/' + row['key']}"}
+            break
+        else:
+            abort(409, "The urls could not be saved, try again")
+
+        app.logger.info(f"{user.username} shortened {len(rows)} urls in a batch")
+        return {"results": results}, (
+            HTTPStatus.CREATED if rows else HTTPStatus.BAD_REQUEST
+        )
+
+
 @url_namespace.route("<string:url_key>/click")
 class URLClickView(Resource):
     @url_namespace.doc(
@@ -93,19 +243,148 @@ class URLClickView(Resource):
 
         # check if url exists
         if url:
-            url.clicks += 1
-            db.session.commit()
+            click_counter.increment(url.key)
+            hot_keys.add(url.key)
             return marshal(url, url_marshal_model), HTTPStatus.OK
         return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
 
 
+STATS_GRANULARITIES = {
+    "hour": (HourlyClicks, hour_bucket, timedelta(hours=1), timedelta(days=1)),
+    "day": (DailyClicks, day_bucket, timedelta(days=1), timedelta(days=30)),
+}
+
+
+def stats_time(name, default):
+    """
+    Reads an ISO 8601 date or datetime from the query string
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"{name} must be an ISO 8601 date or datetime")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+@url_namespace.route("<string:url_key>/stats")
+class URLStatsView(Resource):
+    @url_namespace.doc(
+        description="Get the clicks of a url per hour or per day. Times are in UTC",
+        params={
+            "url_key": "The shortened url key",
+            "from": "Start of the range. Defaults to a day or 30 days before to",
+            "to": "End of the range. Defaults to now",
+            "granularity": "hour or day. Defaults to day",
+        },
+    )
+    def get(self, url_key):
+        """
+        Get click statistics for a shortened url
+        """
+        granularity = request.args.get("granularity", "day")
+        if granularity not in STATS_GRANULARITIES:
+            abort(400, "Granularity must be hour or day")
+        rollup, bucket_of, step, default_range = STATS_GRANULARITIES[granularity]
+
+        end = bucket_of(stats_time("to", datetime.utcnow()))
+        start = bucket_of(stats_time("from", end - default_range))
+        if start > end:
+            abort(400, "from must be before to")
+        if (end - start) // step + 1 > app.config["STATS_MAX_BUCKETS"]:
+            abort(
+                400,
+                f"A range can contain at most {app.config['STATS_MAX_BUCKETS']} buckets",
+            )
+
+        url = Url.get_by_key(url_key)
+
+        # check if url exists
+        if not url:
+            return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
+
+        clicks = dict(
+            db.session.execute(
+                db.select(rollup.bucket, rollup.clicks).where(
+                    rollup.url_key == url.key,
+                    rollup.bucket.between(start, end),
+                )
+            ).all()
+        )
+        # the distinct visitors of the days covering the range
+        visitors = HyperLogLog()
+        for sketch in db.session.execute(
+            db.select(DailyVisitors.visitors).where(
+                DailyVisitors.url_key == url.key,
+                DailyVisitors.bucket.between(day_bucket(start), end),
+            )
+        ).scalars():
+            visitors.merge(HyperLogLog.from_bytes(sketch))
+
+        buckets = []
+        bucket = start
+        while bucket <= end:
+            buckets.append(
+                {"start": bucket.isoformat(), "clicks": clicks.get(bucket, 0)}
+            )
+            bucket += step
+        return {
+            "key": url.key,
+            "granularity": granularity,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "total": sum(clicks.values()),
+            "unique_visitors": visitors.count(),
+            "buckets": buckets,
+        }, HTTPStatus.OK
+
+
+@url_namespace.route("urls/hot")
+class HotURLsView(Resource):
+    @url_namespace.doc(
+        description="Get the most clicked url keys of the last minutes across every worker. Only admins can access this route",
+        params={
+            "window": "Window in minutes. Defaults to 5",
+            "limit": "Number of keys. Defaults to 10",
+        },
+    )
+    @admin_required()
+    def get(self):
+        """
+        Get the hottest url keys
+        """
+        window = request.args.get("window", 5, type=int)
+        limit = request.args.get("limit", 10, type=int)
+        retained = (
+            app.config["HOT_KEYS_BUCKETS"] * app.config["HOT_KEYS_BUCKET_SECONDS"] // 60
+        )
+
+        # validates the window and limit
+        if not 1 <= window <= retained:
+            abort(400, f"Window must be between 1 and {retained} minutes")
+        if not 1 <= limit <= app.config["HOT_KEYS_CAPACITY"]:
+            abort(400, f"Limit must be between 1 and {app.config['HOT_KEYS_CAPACITY']}")
+
+        return {
+            "window": window,
+            "keys": [
+                {"key": key, "clicks": clicks, "error": error}
+                for key, clicks, error in hot_keys.top(limit, window * 60)
+            ],
+        }, HTTPStatus.OK
+
+
 @url_namespace.route("<string:url_key>")
 class SingleURLView(Resource):
     @url_namespace.doc(
         description="Redirect a URL", params={"url_key": "The shortened url key"}
     )
     @limiter.limit("10/minute")
-    @cache.cached(timeout=18000)
+    @cached_view(timeout=18000, tags=("url:{url_key}",))
     def get(self, url_key):
         """
         Redirect shorten url to target url
@@ -132,7 +411,7 @@ class SingleURLView(Resource):
         Delete a url
         """
         identity = get_jwt_identity()
-        jwt_user = User.get_by_id(identity)
+        jwt_user = User.get_current()
         url = Url.get_by_key(url_key)
 
         # checks if url exists
@@ -141,33 +420,143 @@ class SingleURLView(Resource):
             if (jwt_user.is_admin == True) or (identity == url.user_id):
                 url.is_active = False
                 db.session.commit()
+                redirect_cache.evict(url.key)
                 app.logger.info(f"{url.key} was deleted by (user)")
                 return {"message": "Url has been deleted"}, HTTPStatus.OK
             return {"message": "Not allowed."}, HTTPStatus.FORBIDDEN
         return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
 
 
+qrcode_batch_model = url_namespace.model(
+    "qrcode_batch",
+    {
+        "keys": fields.List(fields.String, description="The shortened url keys"),
+        "user_id": fields.Integer(description="Get the qrcodes of every url of a user"),
+    },
+)
+
+qrcode_option_params = {
+    "size": "Size of each qrcode box in pixels. Defaults to 10",
+    "fill": "Color of the qrcode. Defaults to blue",
+    "back": "Background color. Defaults to white",
+    "format": "png or svg. Defaults to png",
+}
+
+qrcode_params = {"url_key": "The shortened url key", **qrcode_option_params}
+
+
+def qrcode_options():
+    """
+    Reads and validates the qrcode options of a request
+    """
+    size = request.args.get("size", 10, type=int)
+    fill = request.args.get("fill", "blue")
+    back = request.args.get("back", "white")
+    image_format = request.args.get("format", "png")
+
+    # validates the qrcode options
+    if not 1 <= size <= 40:
+        abort(400, "Size must be between 1 and 40")
+    if not (valid_color(fill) and valid_color(back)):
+        abort(400, "Colors must be a name or a hex code")
+    if image_format not in QRCODE_MIMETYPES:
+        abort(400, "Format must be png or svg")
+    return size, fill, back, image_format
+
+
+def qrcode_response(url_key):
+    """
+    Sends the cached qrcode of a url, rendering it on a cache miss
+    """
+    options = qrcode_options()
+    image_format = options[-1]
+    url = Url.get_by_key(url_key)
+
+    # checks if url exists
+    if url:
+        digest, data = qrcode_cache.get(url.target_url, *options)
+        response = send_file(
+            io.BytesIO(data),
+            mimetype=QRCODE_MIMETYPES[image_format],
+            etag=digest,
+            max_age=app.config["QRCODE_MAX_AGE"],
+        )
+        app.logger.info(f"Qrcode for {url_key} was generated")
+        return response
+    return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
+
+
 @url_namespace.route("<string:url_key>/qrcode")
 class QRCodeGenerationView(Resource):
     @url_namespace.doc(
-        description="Generate QRCode", params={"url_key": "The shortened url key"}
+        description="Get the QRCode of a url. Supports conditional requests with ETags",
+        params=qrcode_params,
     )
+    def get(self, url_key):
+        """
+        Get qrcode for shortened url
+        """
+        return qrcode_response(url_key)
+
+    @url_namespace.doc(description="Generate QRCode", params=qrcode_params)
     def post(self, url_key):
         """
         Generate qrcode for shortened url
         """
-        url = Url.get_by_key(url_key)
+        return qrcode_response(url_key)
 
-        # checks if url exists
-        if url:
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(url.target_url)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="blue", back_color="white")
-            buffer = io.BytesIO()
-            img.save(buffer)
-            buffer.seek(0)
-            response = send_file(buffer, mimetype="image/png")
-            app.logger.info(f"Qrcode for {url_key} was generated")
-            return response
-        return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
+
+@url_namespace.route("qrcodes")
+class QRCodeBatchView(Resource):
+    @url_namespace.expect(qrcode_batch_model)
+    @url_namespace.doc(
+        description="""Get the QRCodes of a list of url keys, or of every url of a user, as a zip archive.
+        A user's QRCodes can be accessed by an admin or the user whose id is in the user_id field.""",
+        params=qrcode_option_params,
+    )
+    @jwt_required()
+    def post(self):
+        """
+        Generate qrcodes for many shortened urls
+        """
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            abort(400, "Provide a list of keys or a user_id")
+        options = qrcode_options()
+        image_format = options[-1]
+
+        if data.get("user_id") is not None:
+            identity = get_jwt_identity()
+            jwt_user = User.get_current()
+
+            # checks if it is an admin or the user whose id is in the user_id field
+            if not jwt_user.is_admin and identity != data["user_id"]:
+                return {"message": "Not allowed."}, HTTPStatus.FORBIDDEN
+            condition = Url.user_id == data["user_id"]
+        elif isinstance(data.get("keys"), list) and data["keys"]:
+            condition = Url.key.in_(data["keys"])
+        else:
+            abort(400, "Provide a list of keys or a user_id")
+
+        limit = app.config["QRCODE_BATCH_LIMIT"]
+        urls = db.session.execute(
+            db.select(Url.key, Url.target_url)
+            .where(condition)
+            .order_by(Url.id)
+            .limit(limit + 1)
+        ).all()
+        if len(urls) > limit:
+            abort(400, f"A batch can contain at most {limit} qrcodes")
+        if not urls:
+            return {"message": "NOT FOUND"}, HTTPStatus.NOT_FOUND
+
+        files = (
+            (f"{key}.{image_format}", image)
+            for key, image in qrcode_cache.get_many(urls, *options)
+        )
+        app.logger.info(f"{len(urls)} qrcodes were generated in a batch")
+        return Response(
+            stream_with_context(zip_stream(files)),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=qrcodes.zip"},
+        )
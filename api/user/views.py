@@ -1,5 +1,5 @@
 from flask_restx import Namespace, Resource, fields, marshal
-from flask import request, url_for, abort, copy_current_request_context
+from flask import request, url_for, abort
 from ..models.users import User
 from ..models.token import ResetPasswordTokenBlocklist
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -7,17 +7,19 @@ from http import HTTPStatus
 from ..utils import (
     db,
     confirm_token,
-    mail,
+    mail_queue,
     admin_required,
     super_admin_required,
-    cache,
+    cached_view,
     limiter,
+    click_counter,
+    page_args,
+    keyset_page,
 )
+from ..models.urls import Url
 from datetime import datetime
 from flask_mail import Message
-from decouple import config as configuration
 from werkzeug.security import generate_password_hash, check_password_hash
-from threading import Thread
 
 from flask import current_app as app
 
@@ -30,7 +32,8 @@ url_model = user_namespace.model(
         "name": fields.String(description="Name of shortened url"),
         "key": fields.String(description="Shortened url key"),
         "target_url": fields.String(description="Target URL"),
-        "clicks": fields.Integer(),
+        "clicks": fields.Integer(attribute=lambda url: click_counter.total(url)),
+        "unique_visitors": fields.Integer(default=0),
         "user_id": fields.Integer(),
     },
 )
@@ -52,6 +55,40 @@ user_model = user_namespace.model(
         ),
     },
 )
+user_summary_model = user_namespace.model(
+    "user_summary",
+    {
+        "id": fields.Integer(),
+        "username": fields.String(required=True, description="Username"),
+        "email": fields.String(required=True, description="Email"),
+        "first_name": fields.String(required=True, description="Firstname"),
+        "last_name": fields.String(required=True, description="Lastname"),
+        "paid": fields.Boolean(description="User subscription status"),
+        "date_created": fields.DateTime(description="Date user joined"),
+    },
+)
+
+user_page_model = user_namespace.model(
+    "user_page",
+    {
+        "data": fields.List(fields.Nested(user_summary_model)),
+        "next_cursor": fields.String(description="Cursor of the next page"),
+    },
+)
+
+url_page_model = user_namespace.model(
+    "url_page",
+    {
+        "data": fields.List(fields.Nested(url_model)),
+        "next_cursor": fields.String(description="Cursor of the next page"),
+    },
+)
+
+page_params = {
+    "limit": "Number of items per page",
+    "after": "The next_cursor of the previous page",
+}
+
 change_password_model = user_namespace.model(
     "password_reset",
     {
@@ -89,28 +126,27 @@ def send_async_reset(user):
         After the time limit has expired, you will have to resubmit the request for a password reset.
         """,
     )
-
-    @copy_current_request_context
-    def send_message(msg):
-        mail.send(msg)
-
-    sender = Thread(name="mail_sender", target=send_message, args=(msg,))
-    sender.start()
+    mail_queue.send(msg)
 
 
 @user_namespace.route("users")
 class UserList(Resource):
     @user_namespace.doc(
-        description="Get all registered users. Can be accessed by only an admin"
+        description="Get all registered users a page at a time, without their urls. Can be accessed by only an admin",
+        params=page_params,
     )
     @admin_required()
-    @cache.cached(timeout=1800)
+    @cached_view(timeout=1800, tags=("users",))
     def get(self):
         """
         Get all users
         """
-        users = User.query.all()
-        return marshal(users, user_model), 200
+        limit, after = page_args()
+        users, next_cursor = keyset_page(User.query, User.id, limit, after)
+        return (
+            marshal({"data": users, "next_cursor": next_cursor}, user_page_model),
+            200,
+        )
 
 
 @user_namespace.route("user/<int:user_id>")
@@ -126,7 +162,7 @@ class UserView(Resource):
         Get a user by id
         """
         identity = get_jwt_identity()
-        jwt_user = User.get_by_id(identity)
+        jwt_user = User.get_current()
         user = User.get_by_id(user_id)
 
         # checks if it is an admin or the user whose id is in the user_id variable of the url that is accessing the route
@@ -147,7 +183,7 @@ class UserView(Resource):
         user = User.get_by_id(user_id)
 
         # checks if admin is trying to delete the super administrator
-        if user.email == configuration("EMAIL"):
+        if user.email == app.config["SUPER_ADMIN_EMAIL"]:
             return {
                 "Message": "You cannot delete the super administrator"
             }, HTTPStatus.FORBIDDEN
@@ -181,24 +217,30 @@ class UserView(Resource):
 class UserURLsList(Resource):
     @jwt_required()
     @user_namespace.doc(
-        description="""Get all the shortened urls a user has created.
+        description="""Get all the shortened urls a user has created, a page at a time.
         This route can be accessed by an admin or the user whose id is in the user_id variable of the url.""",
-        params={"user_id": "The user id"},
+        params={"user_id": "The user id", **page_params},
     )
-    @cache.cached(timeout=300)
+    @cached_view(timeout=300, tags=("user:{user_id}",), per_identity=True)
     def get(self, user_id):
         """
         Get a user's url history
         """
         identity = get_jwt_identity()
-        jwt_user = User.get_by_id(identity)
+        jwt_user = User.get_current()
         user = User.get_by_id(user_id)
 
         # checks if it is an admin or the user whose id is in the user_id variable of the url that is accessing the route
         if (jwt_user.is_admin == True) or (identity == user_id):
-            urls = user.urls
+            limit, after = page_args()
+            urls, next_cursor = keyset_page(
+                Url.query.filter(Url.user_id == user.id), Url.id, limit, after
+            )
             app.logger.info(f"Admin searched for all urls by {user.username}")
-            return marshal(urls, url_model), HTTPStatus.OK
+            return (
+                marshal({"data": urls, "next_cursor": next_cursor}, url_page_model),
+                HTTPStatus.OK,
+            )
         return {"message": "Not allowed."}, HTTPStatus.FORBIDDEN
 
 
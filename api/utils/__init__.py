@@ -1,10 +1,23 @@
 from .db import db
-import string
-import secrets
 from ..models.urls import Url
+from ..models.keys import ReservedKey
 from .mail import mail
-from .cache import cache
+from .mailqueue import mail_queue
+from .cache import cache, cached_view, invalidate
 from .limiter import limiter
+from .logs import log_pipeline
+from .metrics import metrics
+from .clicks import click_counter
+from .events import click_events, hour_bucket, day_bucket
+from .hll import HyperLogLog
+from .hotkeys import hot_keys
+from .keypool import key_pool
+from .keyindex import key_index
+from .pagination import page_args, keyset_page
+from .revocation import revoked_tokens
+from .claims import user_claims
+from .queries import count_queries, query_budget, query_inspector
+from .qrcodes import qrcode_cache, valid_color, zip_stream, QRCODE_MIMETYPES
 from itsdangerous import URLSafeTimedSerializer
 from decouple import config as configuration
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
@@ -14,20 +27,49 @@ from http import HTTPStatus
 
 def generate_url_key(num_of_chars: int):
     """
-    Generate random string for free user url key
+    Get a reserved random string for free user url key
     """
-    chars = string.ascii_uppercase + string.digits
-    key = "".join(secrets.choice(chars) for _ in range(num_of_chars))
-
-    while Url.get_by_key(key):
-        key = generate_url_key(5)
-    return key
+    return key_pool.get(num_of_chars)
 
 
 def url_key_taken(key):
-    if Url.get_by_key(key):
-        return True
-    return False
+    """
+    Checks if a key is used by a url or reserved for a free user url
+    """
+    if not key_index.might_contain(key):
+        return False
+    return db.session.query(
+        db.exists().where(Url.key == key) | db.exists().where(ReservedKey.key == key)
+    ).scalar()
+
+
+def url_keys_taken(keys, exact=False):
+    """
+    Returns the keys that are used by a url or reserved for a free user url.
+    With exact the key index, which can lag behind other workers, is skipped
+    """
+    if not exact:
+        keys = {key for key in keys if key_index.might_contain(key)}
+    if not keys:
+        return set()
+    return set(
+        db.session.execute(
+            db.select(Url.key)
+            .where(Url.key.in_(keys))
+            .union_all(db.select(ReservedKey.key).where(ReservedKey.key.in_(keys)))
+        ).scalars()
+    )
+
+
+def url_keys_used(keys):
+    """
+    Returns the keys that are used by a url
+    """
+    if not keys:
+        return set()
+    return set(
+        db.session.execute(db.select(Url.key).where(Url.key.in_(keys))).scalars()
+    )
 
 
 def generate_confirmation_token(email):
@@ -0,0 +1,79 @@
+import threading
+from time import monotonic, sleep
+
+CLOSED, OPEN = "closed", "open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency until a background probe succeeds.
+
+    After failure_threshold consecutive failures, or calls slower than
+    slow_call seconds, the breaker opens and allow() returns False so callers
+    use their fallback straight away instead of waiting on timeouts. While
+    open, a daemon thread calls probe every probe_interval seconds and closes
+    the breaker once it succeeds.
+    """
+
+    def __init__(
+        self, name, probe, failure_threshold=3, slow_call=0.25, probe_interval=5
+    ):
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return self.state == CLOSED
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Calls fn, counting an exception or a slow call as a failure
+        """
+        started = monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        if monotonic() - started > self.slow_call:
+            self.record_failure()
+        else:
+            self.failures = 0
+        return result
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == OPEN or self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened += 1
+        threading.Thread(
+            name=f"{self.name}_probe", target=self._probe, daemon=True
+        ).start()
+
+    def metrics(self):
+        return {
+            "state": self.state,
+            "open": int(self.state == OPEN),
+            "opened": self.opened,
+            "failures": self.failures,
+        }
+
+    def _probe(self):
+        while self.state == OPEN:
+            sleep(self.probe_interval)
+            try:
+                if self.probe() is False:
+                    continue
+            except Exception:
+                continue
+            with self._lock:
+                self.state = CLOSED
+                self.failures = 0
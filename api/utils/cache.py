@@ -1,3 +1,93 @@
+from collections import Counter
+from functools import wraps
+from hashlib import sha1
+from uuid import uuid4
+from flask import request
 from flask_caching import Cache
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 
-cache = Cache(config={"CACHE_TYPE": "flask_caching.backends.SimpleCache"})
+# the backend comes from CACHE_TYPE; tag versions live in the same backend, so
+# invalidations only reach other workers when it is shared, e.g. RedisCache
+cache = Cache()
+
+cache_stats = Counter()
+
+
+def tag_versions(tags):
+    """
+    Returns the current version of each tag
+    """
+    keys = [f"tag/{tag}" for tag in tags]
+    versions = dict(zip(keys, cache.get_many(*keys)))
+    # a tag that is unknown or was evicted starts over at a brand new version, so
+    # entries cached under an older version can never be served again
+    missing = {key: uuid4().hex for key, version in versions.items() if not version}
+    if missing:
+        cache.set_many(missing, timeout=0)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*tags):
+    """
+    Drops every cached view under the tags by moving them to a new version
+    """
+    if tags:
+        cache.set_many({f"tag/{tag}": uuid4().hex for tag in set(tags)}, timeout=0)
+
+
+def cached_view(timeout, tags=(), per_identity=False):
+    """
+    Caches a view by path, query string and the versions of its tags.
+
+    Tags are formatted with the view arguments, e.g. "user:{user_id}", so a
+    single invalidate("user:1") drops every page cached for that user.
+    per_identity keeps a separate entry for each jwt identity, for views whose
+    response depends on who is asking.
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            view_tags = [tag.format(**kwargs) for tag in tags]
+            parts = [request.path, *sorted(request.args.items(multi=True))]
+            if per_identity:
+                parts.append(get_jwt_identity())
+            parts.extend(zip(view_tags, tag_versions(view_tags)))
+            key = "view/" + sha1(repr(parts).encode()).hexdigest()
+
+            response = cache.get(key)
+            if response is not None:
+                cache_stats["hits"] += 1
+                return response
+            cache_stats["misses"] += 1
+            response = fn(*args, **kwargs)
+            cache.set(key, response, timeout=timeout)
+            return response
+
+        return decorator
+
+    return wrapper
+
+
+def collect_tags(target, *tags):
+    """
+    Queues tags to invalidate once the session of the changed object commits
+    """
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("cache_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_tags(session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        invalidate(*tags)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_rolled_back_tags(session, previous_transaction):
+    session.info.pop("cache_tags", None)
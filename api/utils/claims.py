@@ -0,0 +1,63 @@
+from decouple import config as configuration
+from sqlalchemy import event
+from .lru import LRUCache
+from ..models.users import User
+
+
+class ClaimsResolver:
+    """
+    Resolves the role claims of a user for the tokens issued to them.
+
+    Claims are cached per identity for CLAIMS_CACHE_TTL seconds, so issuing a
+    token does not load the user again. Changing a user's admin status evicts
+    their entry in this worker; other workers pick it up when the entry expires.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._claims = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SUPER_ADMIN_EMAIL", configuration("EMAIL", None))
+        app.config.setdefault("CLAIMS_CACHE_SIZE", 10000)
+        app.config.setdefault("CLAIMS_CACHE_TTL", 300)
+        app.extensions["user_claims"] = self
+        self.app = app
+        self._claims.configure(
+            app.config["CLAIMS_CACHE_SIZE"], app.config["CLAIMS_CACHE_TTL"]
+        )
+        self._claims.clear()
+
+    def remember(self, user):
+        """
+        Caches the claims of a user that is already loaded
+        """
+        claims = {
+            "is_administrator": bool(user.is_admin),
+            "super_admin": user.email == self.app.config["SUPER_ADMIN_EMAIL"],
+        }
+        self._claims.set(user.id, claims)
+        return claims
+
+    def claims_for(self, identity):
+        """
+        Returns the claims of a user id, loading the user on a cache miss
+        """
+        claims = self._claims.get(identity)
+        if claims is None:
+            claims = self.remember(User.get_by_id(identity))
+        return claims
+
+    def invalidate(self, identity):
+        self._claims.evict(identity)
+
+
+user_claims = ClaimsResolver()
+
+
+@event.listens_for(User.is_admin, "set")
+def invalidate_user_claims(target, value, oldvalue, initiator):
+    if target.id is not None:
+        user_claims.invalidate(target.id)
@@ -0,0 +1,133 @@
+import atexit
+import threading
+from collections import Counter
+from sqlalchemy import bindparam, select
+from .db import db
+from .cache import invalidate
+from ..models.urls import Url
+
+
+def url_tags(connection, keys):
+    """
+    Returns the cache tags of the url keys and of the users who own them
+    """
+    owners = connection.execute(
+        select(Url.user_id).where(Url.key.in_(keys)).distinct()
+    ).scalars()
+    return [
+        *(f"url:{key}" for key in keys),
+        *(f"user:{user_id}" for user_id in owners if user_id is not None),
+    ]
+
+
+class ClickCounter:
+    """
+    Buffers url clicks in memory and writes them to the database in batches
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CLICK_FLUSH_INTERVAL", 5)
+        app.config.setdefault("CLICK_BUFFER_SIZE", 1000)
+        app.extensions["click_counter"] = self
+        if self.app is None:
+            atexit.register(self.flush)
+        self.app = app
+
+    def increment(self, key, amount=1):
+        """
+        Records a click for the url key
+        """
+        with self._lock:
+            self._pending[key] += amount
+            buffer_full = len(self._pending) >= self.app.config["CLICK_BUFFER_SIZE"]
+            if not buffer_full:
+                self._schedule_flush()
+        if buffer_full:
+            # a flush already in progress, or the next one, writes these clicks
+            self.flush(wait=False)
+
+    def pending(self, key):
+        """
+        Returns the number of clicks on a url key not yet written to the database
+        """
+        return self._pending.get(key, 0)
+
+    def total(self, url):
+        """
+        Returns the persisted click count of a url plus its pending clicks
+        """
+        return (url.clicks or 0) + self.pending(url.key)
+
+    def flush(self, wait=True):
+        """
+        Writes all pending clicks to the database as atomic increments.
+
+        The clicks stay pending, and counted by total(), until the write is
+        committed. Without wait nothing is done while another flush runs.
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                pending = Counter(self._pending)
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending or self.app is None:
+                return
+            self._write(pending)
+        finally:
+            self._flush_lock.release()
+            if self.app is not None:
+                with self._lock:
+                    if self._pending:
+                        self._schedule_flush()
+
+    def _write(self, pending):
+        urls = Url.__table__
+        statement = (
+            urls.update()
+            .where(urls.c.key == bindparam("url_key"))
+            .values(clicks=urls.c.clicks + bindparam("amount"))
+        )
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        statement,
+                        [
+                            {"url_key": key, "amount": amount}
+                            for key, amount in pending.items()
+                        ],
+                    )
+                    tags = url_tags(connection, pending)
+                with self._lock:
+                    self._pending.subtract(pending)
+                    for key in pending:
+                        if self._pending[key] <= 0:
+                            del self._pending[key]
+                invalidate(*tags)
+        except Exception:
+            # the clicks are still pending and are written on the next flush
+            self.app.logger.exception("Flushing url clicks failed")
+
+    def _schedule_flush(self):
+        # must be called with the lock held
+        interval = self.app.config["CLICK_FLUSH_INTERVAL"]
+        if not interval or self._timer is not None:
+            return
+        self._timer = threading.Timer(interval, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+click_counter = ClickCounter()
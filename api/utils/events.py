@@ -0,0 +1,290 @@
+import atexit
+import ipaddress
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from hashlib import blake2b
+from time import sleep, time
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from .db import db
+from .cache import invalidate
+from .clicks import url_tags
+from .hll import HyperLogLog
+from ..models.clicks import ClickEvent, DailyClicks, DailyVisitors, HourlyClicks
+from ..models.urls import Url
+
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def ip_prefix(address):
+    """
+    Truncates an ip address to its /24 (IPv4) or /48 (IPv6) network
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return None
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+def user_agent_hash(user_agent):
+    if not user_agent:
+        return None
+    return blake2b(user_agent.encode(), digest_size=8).hexdigest()
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_clicks(connection, rollup, counts):
+    """
+    Adds {(url_key, bucket): clicks} to a rollup table in one statement
+    """
+    # every writer locks rows in the same order, so two flushes of the same
+    # hot keys wait for each other instead of deadlocking on postgres
+    rows = [
+        {"url_key": url_key, "bucket": bucket, "clicks": clicks}
+        for (url_key, bucket), clicks in sorted(counts.items())
+    ]
+    upsert = UPSERT_DIALECTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(rollup)
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[rollup.url_key, rollup.bucket],
+                set_={"clicks": rollup.clicks + statement.excluded.clicks},
+            ),
+            rows,
+        )
+        return
+    for row in rows:
+        result = connection.execute(
+            update(rollup)
+            .where(rollup.url_key == row["url_key"], rollup.bucket == row["bucket"])
+            .values(clicks=rollup.clicks + row["clicks"])
+        )
+        if not result.rowcount:
+            connection.execute(insert(rollup), row)
+
+
+def add_visitors(connection, sketches, daily_sketches):
+    """
+    Merges {url_key: HyperLogLog} into the urls and {(url_key, day): HyperLogLog}
+    into the daily visitor sketches. Returns the keys whose estimate changed
+    """
+    # locking the url rows serializes writers of the same urls on postgres;
+    # rows are locked and written in key order, like the rollups
+    stored = connection.execute(
+        select(Url.key, Url.visitors, Url.unique_visitors)
+        .where(Url.key.in_(sketches))
+        .order_by(Url.key)
+        .with_for_update()
+    ).all()
+    changed = []
+    for key, visitors, unique_visitors in stored:
+        sketch = sketches[key].merge(HyperLogLog.from_bytes(visitors))
+        count = sketch.count()
+        if count != unique_visitors:
+            changed.append(
+                {"url_key": key, "visitors": sketch.to_bytes(), "count": count}
+            )
+    if changed:
+        connection.execute(
+            update(Url)
+            .where(Url.key == bindparam("url_key"))
+            .values(visitors=bindparam("visitors"), unique_visitors=bindparam("count")),
+            changed,
+        )
+
+    upsert = UPSERT_DIALECTS.get(connection.dialect.name)
+    if upsert is not None and daily_sketches:
+        # creates the missing rows first, so another writer inserting the same
+        # day cannot fail the batch, then merges into the locked rows below
+        connection.execute(
+            upsert(DailyVisitors).on_conflict_do_nothing(
+                index_elements=[DailyVisitors.url_key, DailyVisitors.bucket]
+            ),
+            [
+                {"url_key": key, "bucket": day, "visitors": HyperLogLog().to_bytes()}
+                for key, day in sorted(daily_sketches)
+            ],
+        )
+    stored = connection.execute(
+        select(DailyVisitors.url_key, DailyVisitors.bucket, DailyVisitors.visitors)
+        .where(
+            DailyVisitors.url_key.in_(sketches),
+            DailyVisitors.bucket.in_({day for _, day in daily_sketches}),
+        )
+        .order_by(DailyVisitors.url_key, DailyVisitors.bucket)
+        .with_for_update()
+    ).all()
+    existing = []
+    for key, day, visitors in stored:
+        if (key, day) in daily_sketches:
+            sketch = daily_sketches.pop((key, day)).merge(
+                HyperLogLog.from_bytes(visitors)
+            )
+            existing.append({"daily_key": key, "day": day, "sketch": sketch.to_bytes()})
+    if existing:
+        connection.execute(
+            update(DailyVisitors)
+            .where(
+                DailyVisitors.url_key == bindparam("daily_key"),
+                DailyVisitors.bucket == bindparam("day"),
+            )
+            .values(visitors=bindparam("sketch")),
+            existing,
+        )
+    if daily_sketches:
+        # only without an upsert dialect
+        connection.execute(
+            insert(DailyVisitors),
+            [
+                {"url_key": key, "bucket": day, "visitors": sketch.to_bytes()}
+                for (key, day), sketch in sorted(daily_sketches.items())
+            ],
+        )
+    return [row["url_key"] for row in changed]
+
+
+class ClickEventPipeline:
+    """
+    Collects redirect click events in a bounded in-process buffer.
+
+    Emitting an event only appends the raw request details to the buffer; a
+    background writer hashes and truncates them and inserts them in batches,
+    adding each batch to the hourly and daily rollups and to the unique
+    visitor sketches in the same transaction.
+    When the buffer is full new events are dropped and counted instead of
+    slowing the redirect down.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.dropped = 0
+        self.written = 0
+        self._buffer = deque()
+        self._writer = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CLICK_EVENTS_ENABLED", True)
+        app.config.setdefault("CLICK_EVENTS_BUFFER_SIZE", 10000)
+        app.config.setdefault("CLICK_EVENTS_BATCH_SIZE", 1000)
+        app.config.setdefault("CLICK_EVENTS_FLUSH_INTERVAL", 1)
+        app.extensions["click_events"] = self
+        if self.app is None:
+            atexit.register(self.drain)
+        self.app = app
+        self._buffer.clear()
+
+    def emit(self, url_key, environ):
+        """
+        Records a click on a url key from a WSGI environ
+        """
+        if not self.app.config["CLICK_EVENTS_ENABLED"]:
+            return
+        if len(self._buffer) >= self.app.config["CLICK_EVENTS_BUFFER_SIZE"]:
+            self.dropped += 1
+            return
+        self._buffer.append(
+            (
+                url_key,
+                time(),
+                environ.get("HTTP_REFERER"),
+                environ.get("HTTP_USER_AGENT"),
+                environ.get("REMOTE_ADDR"),
+            )
+        )
+        self._start_writer()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def drain(self):
+        """
+        Writes every buffered event to the database
+        """
+        while self._buffer:
+            if not self._write_batch():
+                break
+
+    def _write_batch(self):
+        batch = []
+        for _ in range(self.app.config["CLICK_EVENTS_BATCH_SIZE"]):
+            try:
+                batch.append(self._buffer.popleft())
+            except IndexError:
+                break
+        if not batch:
+            return False
+
+        rows = [
+            {
+                "url_key": url_key,
+                "clicked_at": datetime.utcfromtimestamp(clicked_at),
+                "referrer": referrer[:255] if referrer else None,
+                "user_agent_hash": user_agent_hash(user_agent),
+                "ip_prefix": ip_prefix(address) if address else None,
+            }
+            for url_key, clicked_at, referrer, user_agent, address in batch
+        ]
+        hourly = Counter(
+            (row["url_key"], hour_bucket(row["clicked_at"])) for row in rows
+        )
+        daily = Counter()
+        for (url_key, hour), clicks in hourly.items():
+            daily[url_key, day_bucket(hour)] += clicks
+        # a visitor is an ip address and user agent pair
+        sketches, daily_sketches = {}, {}
+        for row, (_, _, _, user_agent, address) in zip(rows, batch):
+            visitor = f"{address}\0{user_agent}"
+            day = day_bucket(row["clicked_at"])
+            sketches.setdefault(row["url_key"], HyperLogLog()).add(visitor)
+            daily_sketches.setdefault((row["url_key"], day), HyperLogLog()).add(visitor)
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(insert(ClickEvent), rows)
+                    add_clicks(connection, HourlyClicks, hourly)
+                    add_clicks(connection, DailyClicks, daily)
+                    changed = add_visitors(connection, sketches, daily_sketches)
+                    tags = url_tags(connection, changed) if changed else []
+                invalidate(*tags)
+        except Exception:
+            self.dropped += len(rows)
+            self.app.logger.exception("Writing click events failed")
+            return False
+        self.written += len(rows)
+        return True
+
+    def _start_writer(self):
+        interval = self.app.config["CLICK_EVENTS_FLUSH_INTERVAL"]
+        if not interval or self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    name="click_event_writer", target=self._run, daemon=True
+                )
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            sleep(self.app.config["CLICK_EVENTS_FLUSH_INTERVAL"])
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception("Click event writer failed")
+
+
+click_events = ClickEventPipeline()
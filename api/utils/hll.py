@@ -0,0 +1,60 @@
+import math
+import zlib
+from hashlib import blake2b
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of the number of distinct values seen.
+
+    4096 one byte registers give a standard error of about 1.6%. Two sketches
+    merge by taking the larger of each register, so sketches from different
+    workers or time buckets combine into the sketch of their union.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers or REGISTERS)
+
+    def add(self, value):
+        """
+        Adds a value, which is hashed to 64 bits
+        """
+        digest = blake2b(value.encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        index = hashed >> (64 - PRECISION)
+        rest = hashed & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Merges another sketch into this one
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values
+        """
+        estimate = ALPHA * REGISTERS**2 / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # linear counting is more accurate while many registers are empty
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        # most links have few visitors, so their registers are mostly zeros
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        return cls(zlib.decompress(data))
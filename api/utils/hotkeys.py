@@ -0,0 +1,239 @@
+import heapq
+import json
+import os
+import socket
+import threading
+from collections import deque
+from time import sleep, time
+from redis import Redis
+
+
+class SpaceSaving:
+    """
+    Space-Saving sketch of the most frequent keys in a stream.
+
+    At most capacity keys are counted. A new key arriving while the sketch is
+    full replaces the key with the smallest count and inherits that count as
+    its error, so every key whose true count is above total / capacity is
+    guaranteed to be in the sketch and counts are never underestimated.
+
+    The smallest count is found with a min-heap holding one (count, key) entry
+    per key. Increments leave the entries alone, so an entry can be lower than
+    its key's count; a stale entry that reaches the top is pushed back down with
+    the current count. Replacing a key costs O(log capacity) amortized.
+    """
+
+    def __init__(self, capacity, counters=None):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = counters or {}
+        self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, key, amount=1):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += amount
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [amount, 0]
+            heapq.heappush(self._heap, (amount, key))
+        else:
+            count, smallest = self._smallest()
+            del self.counters[smallest]
+            self.counters[key] = [count + amount, count]
+            heapq.heapreplace(self._heap, (count + amount, key))
+
+    def _smallest(self):
+        # the top entry is the smallest count once it is not stale
+        count, key = self._heap[0]
+        while count != self.counters[key][0]:
+            heapq.heapreplace(self._heap, (self.counters[key][0], key))
+            count, key = self._heap[0]
+        return count, key
+
+    def floor(self):
+        """
+        The most a key missing from a full sketch can have been seen
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return self._smallest()[0]
+
+    def merge(self, other):
+        """
+        Returns a sketch of both streams, keeping the capacity largest counts
+        """
+        floor, other_floor = self.floor(), other.floor()
+        merged = {}
+        for key in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(key, (floor, floor))
+            other_count, other_error = other.counters.get(
+                key, (other_floor, other_floor)
+            )
+            merged[key] = [count + other_count, error + other_error]
+        top = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)
+        return SpaceSaving(self.capacity, dict(top[: self.capacity]))
+
+    def top(self, n):
+        items = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in items[:n]]
+
+    def dumps(self):
+        return json.dumps(self.counters, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, capacity, data):
+        return cls(capacity, json.loads(data))
+
+
+class LocalSketchStore:
+    """
+    In-process stand-in for the redis sketch store, for single worker setups
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def publish(self, bucket, worker, data, ttl):
+        with self._lock:
+            self.buckets.setdefault(bucket, {})[worker] = (data, time() + ttl)
+
+    def collect(self, bucket):
+        now = time()
+        with self._lock:
+            workers = self.buckets.get(bucket, {})
+            return [data for data, expires in workers.values() if expires > now]
+
+
+class RedisSketchStore:
+    """
+    Keeps every worker's sketch of a bucket in one redis hash
+    """
+
+    def __init__(self, url):
+        self.redis = Redis.from_url(url, socket_connect_timeout=1)
+
+    def publish(self, bucket, worker, data, ttl):
+        name = f"hotkeys:{bucket}"
+        pipeline = self.redis.pipeline()
+        pipeline.hset(name, worker, data)
+        pipeline.expire(name, ttl)
+        pipeline.execute()
+
+    def collect(self, bucket):
+        return list(self.redis.hgetall(f"hotkeys:{bucket}").values())
+
+
+class HotKeys:
+    """
+    Tracks the most clicked url keys over sliding time windows.
+
+    Clicks are counted in a Space-Saving sketch per HOT_KEYS_BUCKET_SECONDS
+    bucket, keeping the last HOT_KEYS_BUCKETS buckets. Each worker publishes
+    its sketches to redis (HOT_KEYS_REDIS_URL), or to an in-process store when
+    it is not set, and a query merges the sketches of every worker and bucket
+    in the window.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.store = None
+        self._buckets = deque()
+        self._lock = threading.Lock()
+        self._publisher_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("HOT_KEYS_CAPACITY", 200)
+        app.config.setdefault("HOT_KEYS_BUCKET_SECONDS", 60)
+        app.config.setdefault("HOT_KEYS_BUCKETS", 60)
+        app.config.setdefault("HOT_KEYS_SYNC_INTERVAL", 5)
+        app.config.setdefault("HOT_KEYS_REDIS_URL", None)
+        app.extensions["hot_keys"] = self
+        self.app = app
+        self._buckets.clear()
+        if app.config["HOT_KEYS_REDIS_URL"]:
+            self.store = RedisSketchStore(app.config["HOT_KEYS_REDIS_URL"])
+        else:
+            self.store = LocalSketchStore()
+
+    @property
+    def worker(self):
+        # read when publishing, as workers forked from a preloaded app share
+        # this object but must not overwrite each other's sketches
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def bucket_of(self, moment):
+        return int(moment // self.app.config["HOT_KEYS_BUCKET_SECONDS"])
+
+    def add(self, url_key, amount=1):
+        """
+        Counts a click on a url key in the current bucket
+        """
+        bucket = self.bucket_of(time())
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != bucket:
+                self._buckets.append(
+                    (bucket, SpaceSaving(self.app.config["HOT_KEYS_CAPACITY"]))
+                )
+                while len(self._buckets) > self.app.config["HOT_KEYS_BUCKETS"]:
+                    self._buckets.popleft()
+            self._buckets[-1][1].add(url_key, amount)
+        self._start_publisher()
+
+    def publish(self):
+        """
+        Shares this worker's sketches of the retained buckets
+        """
+        ttl = (
+            self.app.config["HOT_KEYS_BUCKETS"]
+            * self.app.config["HOT_KEYS_BUCKET_SECONDS"]
+        )
+        with self._lock:
+            snapshots = [(bucket, sketch.dumps()) for bucket, sketch in self._buckets]
+        for bucket, data in snapshots:
+            self.store.publish(bucket, self.worker, data, ttl)
+
+    def top(self, n=10, window=300):
+        """
+        Returns the n hottest (key, count, error) over the last window seconds
+        across every worker
+        """
+        self.publish()
+        capacity = self.app.config["HOT_KEYS_CAPACITY"]
+        current = self.bucket_of(time())
+        buckets = min(
+            max(window // self.app.config["HOT_KEYS_BUCKET_SECONDS"], 1),
+            self.app.config["HOT_KEYS_BUCKETS"],
+        )
+        merged = SpaceSaving(capacity)
+        for bucket in range(current - buckets + 1, current + 1):
+            for data in self.store.collect(bucket):
+                merged = merged.merge(SpaceSaving.loads(capacity, data))
+        return merged.top(n)
+
+    def _start_publisher(self):
+        interval = self.app.config["HOT_KEYS_SYNC_INTERVAL"]
+        if not interval or self._publisher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._publisher_pid == os.getpid():
+                return
+            # threads do not survive a fork, so each worker starts its own
+            self._publisher_pid = os.getpid()
+        threading.Thread(
+            name="hot_keys_publisher", target=self._run, daemon=True
+        ).start()
+
+    def _run(self):
+        while True:
+            sleep(self.app.config["HOT_KEYS_SYNC_INTERVAL"])
+            try:
+                self.publish()
+            except Exception:
+                self.app.logger.exception("Publishing hot keys failed")
+
+
+hot_keys = HotKeys()
@@ -0,0 +1,239 @@
+import atexit
+import math
+import os
+import struct
+import threading
+from hashlib import blake2b
+from time import monotonic
+from sqlalchemy import event, select
+from .db import db
+from ..models.urls import Url
+from ..models.keys import ReservedKey
+
+SNAPSHOT_HEADER = struct.Struct("<4sQQIQQQ")
+SNAPSHOT_MAGIC = b"SKI1"
+
+
+class BloomFilter:
+    """
+    A fixed size bloom filter for strings
+    """
+
+    def __init__(self, capacity, error_rate, num_bits=None, num_hashes=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = num_bits or max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.num_hashes = num_hashes or max(
+            1, round(self.num_bits / capacity * math.log(2))
+        )
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = struct.unpack("<QQ", digest)
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class KeyIndex:
+    """
+    An in-memory bloom filter of every url key and reserved key.
+
+    A negative answer means the key is definitely not in the database, so the
+    existence query can be skipped. Keys written by other workers are picked up
+    every KEY_INDEX_REFRESH_INTERVAL seconds from the rows added since the last
+    refresh; the unique indexes on both tables remain the final guard.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.filter = None
+        self.last_url_id = 0
+        self.last_reserved_id = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("KEY_INDEX_ENABLED", True)
+        app.config.setdefault("KEY_INDEX_CAPACITY", 1_000_000)
+        app.config.setdefault("KEY_INDEX_FALSE_POSITIVE_RATE", 0.01)
+        app.config.setdefault("KEY_INDEX_REFRESH_INTERVAL", 30)
+        app.config.setdefault("KEY_INDEX_SNAPSHOT", None)
+        app.config.setdefault("KEY_INDEX_WARM_ON_START", True)
+        app.extensions["key_index"] = self
+        if self.app is None:
+            atexit.register(self.save)
+        self.app = app
+        with self._lock:
+            self.filter = None
+        if app.config["KEY_INDEX_ENABLED"] and app.config["KEY_INDEX_WARM_ON_START"]:
+            self.warm()
+
+    def warm(self):
+        """
+        Loads or builds the filter up front so no request has to build it
+        """
+        try:
+            with self.app.app_context(), self._lock:
+                self._ensure_fresh()
+        except Exception:
+            # e.g. the tables do not exist yet; the first lookup builds it then
+            self.filter = None
+            self.app.logger.exception("Building the url key index failed")
+
+    def might_contain(self, key):
+        """
+        Returns False if the key is definitely not used or reserved
+        """
+        if not self.app.config["KEY_INDEX_ENABLED"]:
+            return True
+        with self._lock:
+            self._ensure_fresh()
+            return key in self.filter
+
+    def add(self, key):
+        with self._lock:
+            if self.filter is not None:
+                self.filter.add(key)
+
+    def add_many(self, keys):
+        with self._lock:
+            if self.filter is not None:
+                for key in keys:
+                    self.filter.add(key)
+
+    def rebuild(self):
+        """
+        Builds the filter from every key in the database and saves a snapshot
+        """
+        with self._lock:
+            count = db.session.query(Url.id).count()
+            count += db.session.query(ReservedKey.id).count()
+            capacity = max(self.app.config["KEY_INDEX_CAPACITY"], count * 2)
+            self.filter = BloomFilter(
+                capacity, self.app.config["KEY_INDEX_FALSE_POSITIVE_RATE"]
+            )
+            self.last_url_id = 0
+            self.last_reserved_id = 0
+            self.refresh()
+            self.save()
+            return self.filter.count
+
+    def refresh(self):
+        """
+        Adds the keys inserted since the last refresh
+        """
+        with self._lock:
+            for model, attribute in (
+                (Url, "last_url_id"),
+                (ReservedKey, "last_reserved_id"),
+            ):
+                rows = db.session.execute(
+                    select(model.id, model.key)
+                    .where(model.id > getattr(self, attribute))
+                    .order_by(model.id)
+                    .execution_options(yield_per=10000)
+                )
+                for row_id, key in rows:
+                    if key is not None:
+                        self.filter.add(key)
+                    setattr(self, attribute, row_id)
+            self._refreshed_at = monotonic()
+            if self.filter.count > self.filter.capacity:
+                self.rebuild()
+
+    def save(self, path=None):
+        """
+        Writes the filter to the snapshot file
+        """
+        path = path or (self.app and self.app.config["KEY_INDEX_SNAPSHOT"])
+        if not path or self.filter is None:
+            return
+        with self._lock:
+            header = SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                self.filter.capacity,
+                self.filter.num_bits,
+                self.filter.num_hashes,
+                self.filter.count,
+                self.last_url_id,
+                self.last_reserved_id,
+            )
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as snapshot:
+                snapshot.write(header)
+                snapshot.write(self.filter.bits)
+            os.replace(temporary, path)
+
+    def load(self, path=None):
+        """
+        Reads the filter from the snapshot file. Returns False if there is none
+        """
+        path = path or self.app.config["KEY_INDEX_SNAPSHOT"]
+        if not path or not os.path.exists(path):
+            return False
+        with open(path, "rb") as snapshot:
+            data = snapshot.read()
+        (
+            magic,
+            capacity,
+            num_bits,
+            num_hashes,
+            count,
+            last_url_id,
+            last_reserved_id,
+        ) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            return False
+        # a snapshot ahead of the database was taken against another database
+        if last_url_id > (db.session.query(db.func.max(Url.id)).scalar() or 0):
+            return False
+        bloom = BloomFilter(
+            capacity,
+            self.app.config["KEY_INDEX_FALSE_POSITIVE_RATE"],
+            num_bits=num_bits,
+            num_hashes=num_hashes,
+        )
+        bloom.bits = bytearray(data[SNAPSHOT_HEADER.size :])
+        bloom.count = count
+        with self._lock:
+            self.filter = bloom
+            self.last_url_id = last_url_id
+            self.last_reserved_id = last_reserved_id
+        return True
+
+    def _ensure_fresh(self):
+        if self.filter is None:
+            if self.load():
+                self.refresh()
+            else:
+                self.rebuild()
+        elif (
+            monotonic() - self._refreshed_at
+            >= self.app.config["KEY_INDEX_REFRESH_INTERVAL"]
+        ):
+            self.refresh()
+
+
+key_index = KeyIndex()
+
+
+@event.listens_for(Url, "after_insert")
+def add_url_key_to_index(mapper, connection, target):
+    if target.key is not None:
+        key_index.add(target.key)
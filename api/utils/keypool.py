@@ -0,0 +1,180 @@
+import secrets
+import string
+import threading
+from collections import defaultdict, deque
+from time import perf_counter
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from .db import db
+from ..models.urls import Url
+from ..models.keys import ReservedKey
+from .keyindex import key_index
+
+KEY_CHARS = string.ascii_uppercase + string.digits
+
+
+class KeyPoolExhausted(RuntimeError):
+    pass
+
+
+class KeyPool:
+    """
+    Hands out url keys that are reserved ahead of time in blocks.
+
+    A worker reserves a block of random keys by inserting them into the
+    reserved_keys table, whose unique index guarantees no other worker holds
+    the same key. Keys are then served from memory without any existence check.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._keys = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._refill_thread = None
+        self.refills = 0
+        self.collisions = 0
+        self.last_refill_seconds = 0.0
+        self.refill_seconds_total = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("KEY_POOL_BLOCK_SIZE", 100)
+        app.config.setdefault("KEY_POOL_LOW_WATER", 20)
+        app.config.setdefault("KEY_POOL_ASYNC_REFILL", True)
+        app.config.setdefault("KEY_POOL_RESERVE_ATTEMPTS", 5)
+        app.extensions["key_pool"] = self
+        self.app = app
+        # keys reserved against another app's database are not valid here
+        with self._lock:
+            self._keys.clear()
+
+    def get(self, num_of_chars):
+        """
+        Returns a reserved url key
+        """
+        return self.take(num_of_chars, 1)[0]
+
+    def take(self, num_of_chars, count):
+        """
+        Returns a list of reserved url keys
+        """
+        keys = []
+        while len(keys) < count:
+            with self._lock:
+                pool = self._keys[num_of_chars]
+                while pool and len(keys) < count:
+                    keys.append(pool.popleft())
+            if len(keys) < count:
+                self.refill(num_of_chars, count - len(keys))
+        if self.depth(num_of_chars) < self.app.config["KEY_POOL_LOW_WATER"]:
+            self._refill_in_background(num_of_chars)
+        return keys
+
+    def depth(self, num_of_chars=None):
+        """
+        Returns the number of reserved keys held by this worker
+        """
+        if num_of_chars is None:
+            return sum(len(pool) for pool in self._keys.values())
+        return len(self._keys[num_of_chars])
+
+    def refill(self, num_of_chars, needed=0):
+        """
+        Reserves a new block of keys
+        """
+        with self._refill_lock:
+            low_water = max(needed, self.app.config["KEY_POOL_LOW_WATER"])
+            if self.depth(num_of_chars) >= low_water:
+                return
+            block_size = max(needed, self.app.config["KEY_POOL_BLOCK_SIZE"])
+            started = perf_counter()
+            with self.app.app_context():
+                keys = self._reserve_block(num_of_chars, block_size)
+            elapsed = perf_counter() - started
+
+            with self._lock:
+                self._keys[num_of_chars].extend(keys)
+            self.refills += 1
+            self.last_refill_seconds = elapsed
+            self.refill_seconds_total += elapsed
+            self.app.logger.info(
+                f"Reserved {len(keys)} url keys in {elapsed * 1000:.1f}ms"
+            )
+
+    def metrics(self):
+        return {
+            "depth": self.depth(),
+            "refills": self.refills,
+            "collisions": self.collisions,
+            "last_refill_seconds": self.last_refill_seconds,
+            "refill_seconds_total": self.refill_seconds_total,
+        }
+
+    def _reserve_block(self, num_of_chars, block_size):
+        attempts = self.app.config["KEY_POOL_RESERVE_ATTEMPTS"]
+        for _ in range(attempts):
+            candidates = {
+                "".join(secrets.choice(KEY_CHARS) for _ in range(num_of_chars))
+                for _ in range(block_size)
+            }
+            # only keys the index cannot rule out need an existence check
+            maybe_taken = {key for key in candidates if key_index.might_contain(key)}
+            try:
+                with db.engine.begin() as connection:
+                    taken = set()
+                    if maybe_taken:
+                        taken = set(
+                            connection.execute(
+                                select(Url.key)
+                                .where(Url.key.in_(maybe_taken))
+                                .union_all(
+                                    select(ReservedKey.key).where(
+                                        ReservedKey.key.in_(maybe_taken)
+                                    )
+                                )
+                            ).scalars()
+                        )
+                    keys = list(candidates - taken)
+                    if keys:
+                        connection.execute(
+                            insert(ReservedKey), [{"key": key} for key in keys]
+                        )
+            except IntegrityError:
+                # another worker reserved one of the keys in the meantime
+                self.collisions += 1
+                continue
+            self.collisions += len(taken)
+            if not keys:
+                # every candidate was taken, the key space may be running out
+                continue
+            key_index.add_many(keys)
+            return keys
+        raise KeyPoolExhausted(
+            f"Could not reserve {block_size} keys of {num_of_chars} characters "
+            f"in {attempts} attempts"
+        )
+
+    def _refill_in_background(self, num_of_chars):
+        if not self.app.config["KEY_POOL_ASYNC_REFILL"]:
+            return
+        with self._lock:
+            if self._refill_thread is not None and self._refill_thread.is_alive():
+                return
+            self._refill_thread = threading.Thread(
+                name="key_pool_refill",
+                target=self._safe_refill,
+                args=(num_of_chars,),
+                daemon=True,
+            )
+            self._refill_thread.start()
+
+    def _safe_refill(self, num_of_chars):
+        try:
+            self.refill(num_of_chars)
+        except Exception:
+            self.app.logger.exception("Refilling the url key pool failed")
+
+
+key_pool = KeyPool()
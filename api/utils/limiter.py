@@ -1,12 +1,151 @@
-from flask_limiter import Limiter
+import threading
+from time import time
+import flask_limiter
 from flask_limiter.util import get_remote_address
-from redis import Redis
+from limits.storage import MemoryStorage
+from limits.strategies import (
+    STRATEGIES,
+    FixedWindowRateLimiter,
+    MovingWindowRateLimiter,
+)
+from limits.util import WindowStats
 from decouple import config as configuration
+from .breaker import CircuitBreaker
+from .lru import LRUCache
+
+
+class HybridFixedWindowRateLimiter(FixedWindowRateLimiter):
+    """
+    Fixed window rate limiting that counts hits in process memory first.
+
+    Each key keeps a local bucket of the window's count as last seen in the
+    shared storage plus the hits taken since. Hits are only pushed to the
+    storage, in one increment, once RATELIMIT_SYNC_INTERVAL seconds passed
+    since the last sync or the estimate comes within RATELIMIT_SYNC_THRESHOLD
+    of the limit. Far from their limits clients cost no storage round trip,
+    and close to them every hit is checked against the shared count.
+
+    Every worker may take hits locally at the same time, so each one only takes
+    its share, 1 / RATELIMIT_WORKERS, of the headroom left below the threshold.
+    Limits below RATELIMIT_LOCAL_MIN_LIMIT are always checked against the
+    storage, as their few hits would be off by too much.
+
+    Storage calls go through a circuit breaker. While it is open, because the
+    storage failed or was slow, limits are enforced per process by a moving
+    window over in-memory storage.
+    """
+
+    def __init__(self, storage):
+        super().__init__(storage)
+        # key -> [synced count, unsynced hits, window end, synced at]
+        self.buckets = LRUCache(100_000)
+        self.syncs = 0
+        self.local_hits = 0
+        self.sync_interval = 1
+        self.sync_threshold = 0.8
+        self.workers = 1
+        self.local_min_limit = 100
+        self.fallback = MovingWindowRateLimiter(MemoryStorage())
+        self.breaker = CircuitBreaker("ratelimit_storage", storage.check)
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self.sync_interval = config["RATELIMIT_SYNC_INTERVAL"]
+        self.sync_threshold = config["RATELIMIT_SYNC_THRESHOLD"]
+        self.workers = max(config["RATELIMIT_WORKERS"], 1)
+        self.local_min_limit = config["RATELIMIT_LOCAL_MIN_LIMIT"]
+        self.breaker.failure_threshold = config["RATELIMIT_BREAKER_FAILURES"]
+        self.breaker.slow_call = config["RATELIMIT_BREAKER_SLOW_CALL"]
+        self.breaker.probe_interval = config["RATELIMIT_BREAKER_PROBE_INTERVAL"]
+
+    def hit(self, item, *identifiers, cost=1):
+        if not self.breaker.allow():
+            return self.fallback.hit(item, *identifiers, cost=cost)
+        key = item.key_for(*identifiers)
+        now = time()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None and now >= bucket[2]:
+                # the window is over, so are its unsynced hits
+                bucket = None
+            if (
+                bucket is not None
+                and item.amount >= self.local_min_limit
+                and now - bucket[3] < self.sync_interval
+                and bucket[1] + cost
+                <= (item.amount * self.sync_threshold - bucket[0]) / self.workers
+            ):
+                bucket[1] += cost
+                self.local_hits += 1
+                return True
+            amount = cost
+            if bucket is not None:
+                amount, bucket[1] = amount + bucket[1], 0
+
+        try:
+            count = self.breaker.call(
+                self.storage.incr, key, item.get_expiry(), amount=amount
+            )
+            if count == amount:
+                window_end = now + item.get_expiry()
+            else:
+                window_end = self.breaker.call(self.storage.get_expiry, key)
+        except Exception:
+            self.buckets.evict(key)
+            return self.fallback.hit(item, *identifiers, cost=cost)
+
+        with self._lock:
+            self.syncs += 1
+            if bucket is None:
+                self.buckets.set(key, [count, 0, window_end, now])
+            else:
+                # hits taken locally while syncing stay unsynced
+                bucket[0], bucket[2], bucket[3] = count, window_end, now
+        return count <= item.amount
+
+    def test(self, item, *identifiers):
+        if not self.breaker.allow():
+            return self.fallback.test(item, *identifiers)
+        bucket = self.buckets.get(item.key_for(*identifiers))
+        if bucket is not None and time() < bucket[2]:
+            return bucket[0] + bucket[1] < item.amount
+        return super().test(item, *identifiers)
+
+    def get_window_stats(self, item, *identifiers):
+        if not self.breaker.allow():
+            return self.fallback.get_window_stats(item, *identifiers)
+        bucket = self.buckets.get(item.key_for(*identifiers))
+        if bucket is not None and time() < bucket[2]:
+            return WindowStats(bucket[2], max(0, item.amount - bucket[0] - bucket[1]))
+        return super().get_window_stats(item, *identifiers)
+
+    def clear(self, item, *identifiers):
+        self.buckets.evict(item.key_for(*identifiers))
+        self.fallback.clear(item, *identifiers)
+        super().clear(item, *identifiers)
+
+
+STRATEGIES["hybrid-fixed-window"] = HybridFixedWindowRateLimiter
+
+
+class Limiter(flask_limiter.Limiter):
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_SYNC_INTERVAL", 1)
+        app.config.setdefault("RATELIMIT_SYNC_THRESHOLD", 0.8)
+        app.config.setdefault("RATELIMIT_WORKERS", 1)
+        app.config.setdefault("RATELIMIT_LOCAL_MIN_LIMIT", 100)
+        app.config.setdefault("RATELIMIT_BREAKER_FAILURES", 3)
+        app.config.setdefault("RATELIMIT_BREAKER_SLOW_CALL", 0.25)
+        app.config.setdefault("RATELIMIT_BREAKER_PROBE_INTERVAL", 5)
+        super().init_app(app)
+        if isinstance(self._limiter, HybridFixedWindowRateLimiter):
+            self._limiter.configure(app.config)
+
 
-redis = Redis(host="localhost", port=6379)
 limiter = Limiter(
     key_func=get_remote_address,
     storage_uri=configuration("RATELIMIT_STORAGE_URL"),
-    storage_options={"socket_connect_timeout": 30},
-    strategy="fixed-window",
+    # a slow storage should trip the breaker, not stall requests
+    storage_options={"socket_connect_timeout": 0.5, "socket_timeout": 0.5},
+    strategy="hybrid-fixed-window",
 )
@@ -0,0 +1,186 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+from datetime import datetime, timezone
+from glob import glob
+from logging.handlers import QueueHandler, QueueListener
+from time import perf_counter, time
+from uuid import uuid4
+from flask import g, has_request_context, request
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to a bounded queue and drops them when it is full
+    """
+
+    def prepare(self, record):
+        # QueueHandler.prepare folds the traceback into the message and clears
+        # exc_info; keep them apart so the formatter can write its own field
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Stamps records logged during a request with its id, route and latency
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+            record.route = request.url_rule.rule if request.url_rule else None
+            record.method = request.method
+            started = g.get("request_started")
+            if started is not None:
+                record.latency_ms = round((perf_counter() - started) * 1000, 3)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON line
+    """
+
+    FIELDS = ("request_id", "method", "route", "status", "latency_ms")
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DatedFileHandler(logging.FileHandler):
+    """
+    Appends to a file named after the current period instead of renaming files.
+
+    urlshortener.log is written as urlshortener.2023-06-01.log, and a new file
+    is started every interval days. Every process appends whole lines to the
+    same file and no process ever renames one, so rotation is safe with
+    several gunicorn workers. Only the newest backup_count files are kept.
+    """
+
+    def __init__(self, filename, interval=1, backup_count=5):
+        self.base, self.extension = os.path.splitext(os.path.abspath(filename))
+        self.interval = interval
+        self.backup_count = backup_count
+        self.period = self.current_period()
+        super().__init__(self.filename_for(self.period), delay=True)
+
+    def current_period(self):
+        return int(time() // 86400 // self.interval)
+
+    def filename_for(self, period):
+        day = datetime.fromtimestamp(period * self.interval * 86400, timezone.utc)
+        return f"{self.base}.{day:%Y-%m-%d}{self.extension}"
+
+    def emit(self, record):
+        period = self.current_period()
+        if period != self.period:
+            self.period = period
+            self.close()
+            self.baseFilename = self.filename_for(period)
+            self.remove_old_files()
+        super().emit(record)
+
+    def remove_old_files(self):
+        files = sorted(glob(f"{self.base}.????-??-??{self.extension}"))
+        for filename in files[: -self.backup_count]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                # another process removed it first
+                pass
+
+
+class LogPipeline:
+    """
+    Writes log records from a background thread.
+
+    Loggers only put records on a bounded queue, so a slow disk never holds up
+    a request; when the queue is full records are dropped and counted. A
+    QueueListener thread formats them as JSON lines and writes them out.
+    Requests get an id, taken from the X-Request-ID header when present, and
+    every request is logged once it finishes with its status and latency.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+
+    def start(self, filename, interval=1, backup_count=5, queue_size=10000):
+        if self.listener is not None:
+            return
+        file_handler = DatedFileHandler(filename, interval, backup_count)
+        file_handler.setFormatter(JSONFormatter())
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(RequestContextFilter())
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(self.handler)
+        self.listener = QueueListener(self.handler.queue, file_handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    @property
+    def dropped(self):
+        return self.handler.dropped if self.handler else 0
+
+    def init_app(self, app):
+        app.extensions["log_pipeline"] = self
+        logger = logging.getLogger("api.access")
+
+        @app.before_request
+        def start_request_log():
+            g.request_started = perf_counter()
+            g.request_id = request.headers.get("X-Request-ID") or uuid4().hex
+
+        @app.after_request
+        def finish_request_log(response):
+            response.headers["X-Request-ID"] = g.get("request_id", "")
+            logger.info(
+                f"{request.method} {request.path} {response.status_code}",
+                extra={"status": response.status_code},
+            )
+            return response
+
+
+log_pipeline = LogPipeline()
@@ -0,0 +1,201 @@
+import atexit
+import heapq
+import itertools
+import queue
+import threading
+from collections import deque
+from time import monotonic
+from .mail import mail
+
+
+class MailQueue:
+    """
+    Delivers emails from a bounded queue on a fixed pool of worker threads.
+
+    Each worker takes up to MAIL_BATCH_SIZE queued messages and sends them over
+    a single mail.connect() session, so a burst of signups costs one SMTP/TLS
+    handshake per batch instead of one thread and one handshake per email.
+    A message that fails is retried with exponential backoff up to
+    MAIL_MAX_RETRIES times before it is logged and counted as failed.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._retries = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        self._workers = []
+        self.latencies = deque(maxlen=1000)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MAIL_QUEUE_SIZE", 1000)
+        app.config.setdefault("MAIL_QUEUE_TIMEOUT", 1)
+        app.config.setdefault("MAIL_WORKERS", 2)
+        app.config.setdefault("MAIL_BATCH_SIZE", 50)
+        app.config.setdefault("MAIL_MAX_RETRIES", 3)
+        app.config.setdefault("MAIL_RETRY_BACKOFF", 1)
+        app.extensions["mail_queue"] = self
+        if self.app is None:
+            atexit.register(self.join, 5)
+        self.app = app
+        self._queue = queue.Queue(app.config["MAIL_QUEUE_SIZE"])
+        self._retries = []
+        self._workers = []
+        self._outstanding = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latencies.clear()
+
+    def send(self, message):
+        """
+        Queues a message for delivery. Returns False if the queue stayed full
+        """
+        self._start_workers()
+        with self._lock:
+            self._outstanding += 1
+        try:
+            self._queue.put(
+                (message, 0, monotonic()),
+                timeout=self.app.config["MAIL_QUEUE_TIMEOUT"],
+            )
+        except queue.Full:
+            self._done(dropped=True)
+            self.app.logger.error(f"Mail queue is full, dropped {message.subject!r}")
+            return False
+        return True
+
+    def depth(self):
+        """
+        Returns the number of messages waiting to be sent, including retries
+        """
+        return self._queue.qsize() + len(self._retries)
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued message was sent or given up on
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._idle:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.depth(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "latency_p50_seconds": latencies[len(latencies) // 2] if latencies else 0,
+            "latency_max_seconds": latencies[-1] if latencies else 0,
+        }
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        with self._lock:
+            if not self._workers:
+                self._workers = [
+                    threading.Thread(
+                        name=f"mail_worker_{n}",
+                        target=self._run,
+                        args=(self.app, self._queue),
+                        daemon=True,
+                    )
+                    for n in range(self.app.config["MAIL_WORKERS"])
+                ]
+                for worker in self._workers:
+                    worker.start()
+
+    def _run(self, app, messages):
+        # a worker serves the app and queue it was started for, so workers of
+        # an app that was replaced (as in tests) stop on their own
+        while self.app is app:
+            batch = self._next_batch(messages)
+            if batch:
+                self._deliver(batch)
+
+    def _next_batch(self, messages):
+        with self._lock:
+            now = monotonic()
+            batch = []
+            while self._retries and self._retries[0][0] <= now:
+                batch.append(heapq.heappop(self._retries)[2])
+            wait = self._retries[0][0] - now if self._retries else 0.5
+        size = self.app.config["MAIL_BATCH_SIZE"]
+        try:
+            if not batch:
+                batch.append(messages.get(timeout=min(wait, 0.5)))
+            while len(batch) < size:
+                batch.append(messages.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _deliver(self, batch):
+        pending = deque(batch)
+        while pending:
+            connected = False
+            try:
+                with self.app.app_context(), mail.connect() as connection:
+                    connected = True
+                    while pending:
+                        message, attempt, queued_at = pending[0]
+                        connection.send(message)
+                        pending.popleft()
+                        self.latencies.append(monotonic() - queued_at)
+                        self._done()
+            except Exception as error:
+                if connected:
+                    # the rest of the batch is sent over a new connection
+                    failed = [pending.popleft()] if pending else []
+                else:
+                    failed, pending = list(pending), deque()
+                for item in failed:
+                    self._retry(item, error)
+
+    def _retry(self, item, error):
+        message, attempt, queued_at = item
+        if attempt >= self.app.config["MAIL_MAX_RETRIES"]:
+            self.app.logger.error(
+                f"Sending {message.subject!r} to {message.recipients} failed: {error}"
+            )
+            self._done(failed=True)
+            return
+        self.retried += 1
+        delay = self.app.config["MAIL_RETRY_BACKOFF"] * 2**attempt
+        with self._lock:
+            heapq.heappush(
+                self._retries,
+                (
+                    monotonic() + delay,
+                    next(self._sequence),
+                    (message, attempt + 1, queued_at),
+                ),
+            )
+
+    def _done(self, failed=False, dropped=False):
+        with self._idle:
+            if dropped:
+                self.dropped += 1
+            elif failed:
+                self.failed += 1
+            else:
+                self.sent += 1
+            self._outstanding -= 1
+            self._idle.notify_all()
+
+
+mail_queue = MailQueue()
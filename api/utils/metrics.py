@@ -0,0 +1,345 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from glob import glob
+from time import perf_counter, time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .cache import cache_stats
+from .events import click_events
+from .keypool import key_pool
+from .limiter import limiter
+from .logs import log_pipeline
+from .mailqueue import mail_queue
+from .queries import query_inspector
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metrics:
+    """
+    Prometheus style counters, gauges and histograms kept in process memory.
+
+    Request hooks time every route, SQLAlchemy engine listeners time every
+    query, and the state of the caches, mail queue and limiter is read when
+    metrics are collected. With METRICS_DIR set, each worker writes a snapshot
+    of its metrics to that directory every METRICS_SYNC_INTERVAL seconds and
+    /metrics sums the snapshots of every worker, so the numbers cover the
+    whole gunicorn server. Snapshots of workers that stopped writing for three
+    sync intervals, e.g. after a restart, are deleted.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.types = {}
+        self.help = {}
+        self.buckets = {}
+        self.values = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._writer_pid = None
+        self._writer_stop = threading.Event()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS_DIR", None)
+        app.config.setdefault("METRICS_SYNC_INTERVAL", 5)
+        app.extensions["metrics"] = self
+        self.stop_writer()
+        self.app = app
+        with self._lock:
+            self.values.clear()
+            self.histograms.clear()
+
+        self.describe("http_requests_total", "counter", "Requests by route and status")
+        self.describe(
+            "http_request_duration_seconds",
+            "histogram",
+            "Request latency by route",
+            LATENCY_BUCKETS,
+        )
+        self.describe(
+            "http_request_db_queries",
+            "histogram",
+            "Database queries run by a request",
+            QUERY_COUNT_BUCKETS,
+        )
+        self.describe("db_queries_total", "counter", "Database queries")
+        self.describe(
+            "db_query_duration_seconds",
+            "histogram",
+            "Database query latency",
+            LATENCY_BUCKETS,
+        )
+        self.describe(
+            "ratelimit_rejections_total", "counter", "Requests rejected by a limit"
+        )
+        self.describe("cache_requests_total", "counter", "Cached view lookups")
+        self.describe("mail_queue_depth", "gauge", "Emails waiting to be sent")
+        self.describe("mail_sent_total", "counter", "Emails by outcome")
+        self.describe(
+            "ratelimit_storage_breaker_open",
+            "gauge",
+            "1 while the rate limit storage circuit breaker is open",
+        )
+        self.describe(
+            "click_events_dropped_total", "counter", "Click events not recorded"
+        )
+        self.describe("log_records_dropped_total", "counter", "Log records dropped")
+        self.describe(
+            "db_repeated_queries_total",
+            "counter",
+            "Requests that repeated a query, a suspected N+1",
+        )
+        self.describe("key_pool_depth", "gauge", "Reserved url keys held in memory")
+        self.describe("key_pool_refills_total", "counter", "Url key blocks reserved")
+        self.describe(
+            "key_pool_collisions_total", "counter", "Url keys found taken on refill"
+        )
+        self.describe(
+            "key_pool_last_refill_seconds", "gauge", "Duration of the last refill"
+        )
+        self.describe(
+            "key_pool_refill_seconds_total", "counter", "Time spent reserving keys"
+        )
+
+        if not self._listening:
+            # the timer is started by queries.before_query
+            event.listen(Engine, "after_cursor_execute", self._query_finished)
+            self._listening = True
+
+        @app.before_request
+        def start_request_metrics():
+            g.metrics_started = perf_counter()
+            g.db_queries = 0
+            self._start_writer()
+
+        @app.after_request
+        def record_request_metrics(response):
+            started = g.pop("metrics_started", None)
+            if started is None:
+                return response
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            self.inc(
+                "http_requests_total",
+                method=request.method,
+                route=route,
+                status=str(response.status_code),
+            )
+            self.observe(
+                "http_request_duration_seconds",
+                perf_counter() - started,
+                method=request.method,
+                route=route,
+            )
+            self.observe(
+                "http_request_db_queries",
+                g.pop("db_queries", 0),
+                method=request.method,
+                route=route,
+            )
+            if response.status_code == 429:
+                self.inc("ratelimit_rejections_total", route=route)
+            return response
+
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+    def describe(self, name, kind, help, buckets=None):
+        self.types[name] = kind
+        self.help[name] = help
+        if buckets is not None:
+            self.buckets[name] = buckets
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0, 0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def collect(self):
+        """
+        Returns a snapshot of this worker's metrics
+        """
+        values = [
+            ("cache_requests_total", {"result": "hit"}, cache_stats["hits"]),
+            ("cache_requests_total", {"result": "miss"}, cache_stats["misses"]),
+            ("mail_queue_depth", {}, mail_queue.depth()),
+            ("mail_sent_total", {"result": "sent"}, mail_queue.sent),
+            ("mail_sent_total", {"result": "failed"}, mail_queue.failed),
+            ("mail_sent_total", {"result": "dropped"}, mail_queue.dropped),
+            ("click_events_dropped_total", {}, click_events.dropped),
+            ("log_records_dropped_total", {}, log_pipeline.dropped),
+        ]
+        pool = key_pool.metrics()
+        values.extend(
+            [
+                ("key_pool_depth", {}, pool["depth"]),
+                ("key_pool_refills_total", {}, pool["refills"]),
+                ("key_pool_collisions_total", {}, pool["collisions"]),
+                ("key_pool_last_refill_seconds", {}, pool["last_refill_seconds"]),
+                ("key_pool_refill_seconds_total", {}, pool["refill_seconds_total"]),
+            ]
+        )
+        values.extend(
+            ("db_repeated_queries_total", {"route": route}, count)
+            for (route, _), count in query_inspector.suspects.items()
+        )
+        breaker = getattr(limiter.limiter, "breaker", None)
+        if breaker is not None:
+            values.append(
+                ("ratelimit_storage_breaker_open", {}, breaker.metrics()["open"])
+            )
+        with self._lock:
+            values.extend(
+                (name, dict(labels), value)
+                for (name, labels), value in self.values.items()
+            )
+            histograms = [
+                (name, dict(labels), list(counts), total, count)
+                for (name, labels), (counts, total, count) in self.histograms.items()
+            ]
+        return {"time": time(), "values": values, "histograms": histograms}
+
+    def aggregate(self):
+        """
+        Sums the snapshots of every worker sharing METRICS_DIR
+        """
+        directory = self.app.config["METRICS_DIR"]
+        if not directory:
+            return [self.collect()]
+        self.write()
+        stale = time() - 3 * self.app.config["METRICS_SYNC_INTERVAL"]
+        snapshots = []
+        for filename in glob(os.path.join(directory, "*.json")):
+            try:
+                if os.path.getmtime(filename) < stale:
+                    # the worker is gone, its counters must not be summed forever
+                    os.remove(filename)
+                    continue
+                with open(filename) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # a worker is replacing its file or exited while writing it
+                continue
+        return snapshots
+
+    def write(self):
+        directory = self.app.config["METRICS_DIR"]
+        filename = os.path.join(directory, f"{os.getpid()}.json")
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{filename}.tmp", "w") as file:
+            json.dump(self.collect(), file)
+        os.replace(f"{filename}.tmp", filename)
+
+    def render(self):
+        """
+        Renders the metrics of every worker in the Prometheus text format
+        """
+        values, histograms = {}, {}
+        for snapshot in self.aggregate():
+            for name, labels, value in snapshot["values"]:
+                key = (name, tuple(sorted(labels.items())))
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+
+        lines = []
+        for name in self.types:
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {self.types[name]}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets[name], counts):
+                    cumulative += bucket_count
+                    bucket_labels = format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+    def _query_finished(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        started = conn.info.pop("query_started", None)
+        if started is None:
+            return
+        self.inc("db_queries_total")
+        self.observe("db_query_duration_seconds", perf_counter() - started)
+        if has_request_context():
+            g.db_queries = g.get("db_queries", 0) + 1
+
+    def _start_writer(self):
+        if not self.app.config["METRICS_DIR"] or self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            # gunicorn forks workers after the app is created, so each worker
+            # starts its own writer on its first request
+            self._writer_pid = os.getpid()
+            self._writer_stop = threading.Event()
+        threading.Thread(
+            name="metrics_writer",
+            target=self._run,
+            args=(self._writer_stop,),
+            daemon=True,
+        ).start()
+
+    def stop_writer(self):
+        """
+        Stops this worker's snapshot writer, the next request starts a new one
+        """
+        with self._lock:
+            self._writer_stop.set()
+            self._writer_pid = None
+
+    def _run(self, stop):
+        while not stop.wait(self.app.config["METRICS_SYNC_INTERVAL"]):
+            if not self.app.config["METRICS_DIR"]:
+                return
+            try:
+                self.write()
+            except Exception:
+                self.app.logger.exception("Writing metrics failed")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
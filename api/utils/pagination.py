@@ -0,0 +1,46 @@
+import base64
+import binascii
+from flask import abort, current_app, request
+
+
+def encode_cursor(value):
+    """
+    Encodes the id of the last item on a page as an opaque cursor
+    """
+    return base64.urlsafe_b64encode(str(value).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor into the id of the last item already returned
+    """
+    if not cursor:
+        return 0
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(cursor + padding).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, "Invalid cursor")
+
+
+def page_args():
+    """
+    Reads the limit and after query parameters of a paginated request
+    """
+    limit = request.args.get("limit", current_app.config["PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["MAX_PAGE_SIZE"]))
+    return limit, decode_cursor(request.args.get("after"))
+
+
+def keyset_page(query, column, limit, after):
+    """
+    Returns the items of a query after the cursor and the cursor of the next page.
+
+    The page is an indexed range scan on the column instead of an OFFSET.
+    """
+    items = query.filter(column > after).order_by(column).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(getattr(items[-1], column.key))
+    return items, next_cursor
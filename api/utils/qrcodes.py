@@ -0,0 +1,202 @@
+import atexit
+import io
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+import qrcode
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import sha256
+from qrcode.image.svg import SvgPathImage
+from PIL import ImageColor
+from .cache import cache
+from .lru import LRUCache
+
+QRCODE_MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+COLOR_PATTERN = re.compile(r"^(#[0-9a-fA-F]{3}|#[0-9a-fA-F]{6}|[a-zA-Z]{1,20})$")
+
+
+def valid_color(color):
+    """
+    Accepts #rgb, #rrggbb and the color names PIL can draw with
+    """
+    if not COLOR_PATTERN.match(color or ""):
+        return False
+    try:
+        ImageColor.getrgb(color)
+    except ValueError:
+        return False
+    return True
+
+
+def render_qrcode(target_url, size=10, fill="blue", back="white", image_format="png"):
+    """
+    Renders the qrcode of a target url as png or svg bytes
+    """
+    qr = qrcode.QRCode(version=1, box_size=size, border=5)
+    qr.add_data(target_url)
+    qr.make(fit=True)
+    if image_format == "svg":
+        image_factory = type(
+            "SvgQRCodeImage",
+            (SvgPathImage,),
+            {
+                "background": back,
+                "QR_PATH_STYLE": {**SvgPathImage.QR_PATH_STYLE, "fill": fill},
+            },
+        )
+        img = qr.make_image(image_factory=image_factory)
+    else:
+        img = qr.make_image(fill_color=fill, back_color=back)
+    buffer = io.BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+class QRCodeCache:
+    """
+    Caches rendered qrcodes by a digest of everything that affects the output.
+
+    Renders are kept in an in-process LRU cache in front of the Flask-Caching
+    backend, so a hot code is neither re-rendered nor re-fetched.
+    """
+
+    def __init__(self, app=None):
+        self.local = LRUCache()
+        self.app = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("QRCODE_CACHE_SIZE", 512)
+        app.config.setdefault("QRCODE_CACHE_TIMEOUT", 86400)
+        app.config.setdefault("QRCODE_WORKERS", os.cpu_count())
+        app.extensions["qrcode_cache"] = self
+        if self.app is None:
+            atexit.register(self.shutdown)
+        self.app = app
+        self.local.configure(app.config["QRCODE_CACHE_SIZE"])
+
+    @staticmethod
+    def digest(target_url, size, fill, back, image_format):
+        return sha256(
+            "\0".join((target_url, str(size), fill, back, image_format)).encode()
+        ).hexdigest()
+
+    def get(self, target_url, size=10, fill="blue", back="white", image_format="png"):
+        """
+        Returns the digest and bytes of a qrcode, rendering it on a cache miss
+        """
+        digest = self.digest(target_url, size, fill, back, image_format)
+        data = self.local.get(digest)
+        if data is None:
+            data = cache.get(f"qrcode/{digest}")
+            if data is None:
+                data = render_qrcode(target_url, size, fill, back, image_format)
+                cache.set(
+                    f"qrcode/{digest}",
+                    data,
+                    timeout=self.app.config["QRCODE_CACHE_TIMEOUT"],
+                )
+            self.local.set(digest, data)
+        return digest, data
+
+    def get_many(self, urls, size=10, fill="blue", back="white", image_format="png"):
+        """
+        Yields the key and qrcode bytes of each (key, target_url) pair in order.
+
+        Cache misses are rendered on a process pool since qrcode and PIL are CPU
+        bound. At most QRCODE_WORKERS * 4 renders are in flight at once, so memory
+        stays bounded however many urls are requested.
+        """
+        window = self.app.config["QRCODE_WORKERS"] * 4
+        in_flight = deque()
+        for key, target_url in urls:
+            digest = self.digest(target_url, size, fill, back, image_format)
+            data = self.local.get(digest) or cache.get(f"qrcode/{digest}")
+            if data is None:
+                render = self.executor.submit(
+                    render_qrcode, target_url, size, fill, back, image_format
+                )
+            else:
+                render = Future()
+                render.set_result(data)
+            in_flight.append((key, digest, render))
+            if len(in_flight) >= window:
+                yield self._collect(*in_flight.popleft())
+        while in_flight:
+            yield self._collect(*in_flight.popleft())
+
+    @property
+    def executor(self):
+        # the pool is created on first use in a threaded worker, so its
+        # processes are spawned rather than forked from a process with running
+        # threads, and a pool inherited from a preloading parent is replaced
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    self.app.config["QRCODE_WORKERS"],
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def _collect(self, key, digest, render):
+        data = render.result()
+        if self.local.get(digest) is None:
+            self.local.set(digest, data)
+            cache.set(
+                f"qrcode/{digest}",
+                data,
+                timeout=self.app.config["QRCODE_CACHE_TIMEOUT"],
+            )
+        return key, data
+
+
+class _ZipBuffer(io.RawIOBase):
+    """
+    A write only, unseekable buffer that zipfile streams an archive into
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def zip_stream(files):
+    """
+    Yields a zip archive of (name, bytes) pairs chunk by chunk
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files:
+            compression = zipfile.ZIP_STORED
+            if name.endswith(".svg"):
+                compression = zipfile.ZIP_DEFLATED
+            archive.writestr(name, data, compress_type=compression)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+qrcode_cache = QRCodeCache()
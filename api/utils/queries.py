@@ -0,0 +1,167 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(
+    r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)"
+)
+PLACEHOLDERS = re.compile(r"%\(\w+\)s|:\w+|\?")
+WHITESPACE = re.compile(r"\s+")
+
+# counters of the count_queries blocks in progress
+active_counters = []
+
+
+def fingerprint(statement):
+    """
+    Reduces a statement to its shape, so the same query with different
+    parameters, literals or IN list lengths gets the same fingerprint
+    """
+    statement = LITERALS.sub("?", statement)
+    statement = PLACEHOLDER_LISTS.sub("(?)", statement)
+    statement = PLACEHOLDERS.sub("?", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryCounter:
+    """
+    Counts and fingerprints the SQL statements run while it is active.
+    The statements themselves are only kept with keep_statements
+    """
+
+    def __init__(self, table=None, keep_statements=True):
+        self.pattern = table and re.compile(
+            rf"\b(FROM|JOIN|INTO|UPDATE)\s+\"?{re.escape(table)}\"?\b", re.IGNORECASE
+        )
+        self.keep_statements = keep_statements
+        self.statements = []
+        self.fingerprints = Counter()
+        self.count = 0
+
+    def repeated(self, threshold):
+        """
+        Returns the fingerprints run at least threshold times, a sign of a
+        query issued once per row of another query (N+1)
+        """
+        return {
+            query: count
+            for query, count in self.fingerprints.most_common()
+            if count >= threshold
+        }
+
+    def summary(self):
+        return "\n".join(
+            f"{count} x {query}" for query, count in self.fingerprints.most_common()
+        )
+
+    def add(self, statement):
+        if self.pattern is None or self.pattern.search(statement):
+            self.count += 1
+            if self.keep_statements:
+                self.statements.append(statement)
+            self.fingerprints[fingerprint(statement)] += 1
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    The one engine wide listener before each statement: starts the query
+    timer read by the metrics and feeds the active query counters
+    """
+    conn.info["query_started"] = perf_counter()
+    for counter in active_counters:
+        counter.add(statement)
+    if has_request_context():
+        queries = g.get("queries")
+        if queries is not None:
+            queries.add(statement)
+
+
+@contextmanager
+def count_queries(table=None):
+    """
+    Counts the statements run against the database, or against one table.
+
+    with count_queries("users") as queries:
+        client.get("/user/1", headers=headers)
+    assert queries.count == 1
+    """
+    counter = QueryCounter(table)
+    active_counters.append(counter)
+    try:
+        yield counter
+    finally:
+        active_counters.remove(counter)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries, table=None, max_repeats=None):
+    """
+    Fails when the block runs more than max_queries statements, or when one
+    fingerprint runs more than max_repeats times.
+
+    with query_budget(2):
+        client.get("/user/1/urls", headers=headers)
+    """
+    with count_queries(table) as queries:
+        yield queries
+    if queries.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{queries.count} queries run, the budget is {max_queries}:\n"
+            + queries.summary()
+        )
+    if max_repeats is not None and queries.repeated(max_repeats + 1):
+        raise QueryBudgetExceeded(
+            f"A query ran more than {max_repeats} times:\n" + queries.summary()
+        )
+
+
+class QueryInspector:
+    """
+    Fingerprints the queries of every request and logs a warning when one
+    fingerprint runs QUERY_REPEAT_THRESHOLD times or more in a request.
+    A threshold of None turns it off. Statement texts are only kept when testing
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.suspects = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("QUERY_REPEAT_THRESHOLD", 5)
+        app.extensions["query_inspector"] = self
+        self.app = app
+        self.suspects.clear()
+
+        @app.before_request
+        def start_query_log():
+            if app.config["QUERY_REPEAT_THRESHOLD"]:
+                g.queries = QueryCounter(keep_statements=app.testing)
+
+        @app.after_request
+        def inspect_query_log(response):
+            queries = g.pop("queries", None)
+            if queries is None:
+                return response
+            route = request.url_rule.rule if request.url_rule else request.path
+            threshold = app.config["QUERY_REPEAT_THRESHOLD"]
+            for query, count in queries.repeated(threshold).items():
+                self.suspects[route, query] += 1
+                app.logger.warning(
+                    f"Suspected N+1 on {request.method} {route}: {count} x {query}"
+                )
+            return response
+
+
+query_inspector = QueryInspector()
@@ -0,0 +1,85 @@
+import threading
+from datetime import datetime, timedelta
+from time import monotonic, time
+from .db import db
+from ..models.blocklist import TokenBlocklist
+
+
+class RevocationStore:
+    """
+    Keeps the jti of every revoked, unexpired token in memory.
+
+    The set is loaded from the blocklist table on first use and then only picks
+    up rows added by other workers, every REVOCATION_SYNC_INTERVAL seconds.
+    Entries are dropped once the token they revoke has expired.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._revoked = {}
+        self._last_id = 0
+        self._synced_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REVOCATION_SYNC_INTERVAL", 5)
+        app.extensions["revoked_tokens"] = self
+        self.app = app
+        with self._lock:
+            self._revoked = {}
+            self._last_id = 0
+            self._synced_at = None
+
+    def add(self, jti, expires):
+        """
+        Marks a token as revoked in this worker until its exp timestamp
+        """
+        with self._lock:
+            self._revoked[jti] = expires
+
+    def is_revoked(self, jti):
+        with self._lock:
+            if (
+                self._synced_at is None
+                or monotonic() - self._synced_at
+                >= self.app.config["REVOCATION_SYNC_INTERVAL"]
+            ):
+                self._sync()
+            expires = self._revoked.get(jti)
+        return expires is not None and expires > time()
+
+    def _sync(self):
+        # must be called with the lock held
+        now = time()
+        longest_lifetime = max(
+            self.app.config["JWT_ACCESS_TOKEN_EXPIRES"],
+            self.app.config["JWT_REFRESH_TOKEN_EXPIRES"],
+        )
+        rows = db.session.execute(
+            db.select(
+                TokenBlocklist.id,
+                TokenBlocklist.jti,
+                TokenBlocklist.expires_at,
+                TokenBlocklist.created_at,
+            )
+            .where(TokenBlocklist.id > self._last_id)
+            .order_by(TokenBlocklist.id)
+        )
+        for row_id, jti, expires_at, created_at in rows:
+            # rows written before expires_at existed expire with the longest lived token
+            expires_at = (
+                expires_at or (created_at or datetime.utcnow()) + longest_lifetime
+            )
+            expires = (expires_at - datetime(1970, 1, 1)).total_seconds()
+            if expires > now:
+                self._revoked[jti] = expires
+            self._last_id = row_id
+        self._revoked = {
+            jti: expires for jti, expires in self._revoked.items() if expires > now
+        }
+        self._synced_at = monotonic()
+
+
+revoked_tokens = RevocationStore()
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the hot endpoints.
+
+Run with ``python -m benchmarks`` from the project directory, see README.md.
+"""
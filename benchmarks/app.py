@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+# the benchmarks run offline: sqlite instead of postgres and in-process
+# stand-ins for redis (memory:// limiter storage, the simple cache backend and
+# the local hot keys store)
+# the benchmarks drop and recreate every table, so they never use DATABASE_URL,
+# which may point at a real database, but BENCHMARK_DATABASE_URL
+BENCHMARK_DATABASE_URL = os.environ.get(
+    "BENCHMARK_DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "scissor-benchmark.db"),
+)
+# the app's config module requires it to be set
+os.environ.setdefault("DATABASE_URL", BENCHMARK_DATABASE_URL)
+os.environ.setdefault("RATELIMIT_STORAGE_URL", "memory://")
+os.environ.setdefault("DOMAIN_URL", "http://localhost")
+os.environ.setdefault("DEBUG", "False")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("SECURITY_PASSWORD_SALT", "benchmark")
+
+from sqlalchemy.engine import make_url
+from api import create_app
+from api.config.config import Config
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = BENCHMARK_DATABASE_URL
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    MAIL_SUPPRESS_SEND = True
+    KEY_INDEX_SNAPSHOT = None
+    KEY_INDEX_WARM_ON_START = False
+    HOT_KEYS_REDIS_URL = None
+    METRICS_DIR = None
+    # every benchmark client redirects from the same address
+    REDIRECT_RATE_LIMIT = None
+
+
+def is_benchmark_database(uri):
+    """
+    Only sqlite files and databases named after the benchmarks may be seeded
+    """
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" or "benchmark" in (url.database or "")
+
+
+def create_benchmark_app():
+    """
+    Also used by gunicorn: gunicorn "benchmarks.app:create_benchmark_app()"
+    """
+    return create_app(config=BenchmarkConfig)
@@ -0,0 +1,340 @@
+"""
+Seeds a benchmark database, drives the hot endpoints through the Flask test
+client and a gunicorn server, and compares the results with the previous run
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import monotonic, perf_counter, sleep
+from .app import (
+    BENCHMARK_DATABASE_URL,
+    create_benchmark_app,
+    is_benchmark_database,
+)
+
+PASSWORD = "benchmark"
+
+
+def seed(app, users, urls, rng):
+    """
+    Creates a fresh database with users and urls. Returns the url keys and a
+    login and access token for every user
+    """
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from api.models.urls import Url
+    from api.models.users import User
+    from api.utils import db
+
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if not is_benchmark_database(uri):
+        raise RuntimeError(
+            f"Refusing to drop the tables of {uri!r}, use a sqlite database or "
+            "one with benchmark in its name"
+        )
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # hashing is deliberately slow, every user shares one hash
+        password = generate_password_hash(PASSWORD)
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "first_name": "Bench",
+                    "last_name": f"User{n}",
+                    "username": f"bench{n}",
+                    "email": f"bench{n}@example.com",
+                    "password": password,
+                    "confirmed": True,
+                    "paid": False,
+                    "is_admin": False,
+                }
+                for n in range(users)
+            ],
+        )
+        user_ids = db.session.execute(db.select(User.id)).scalars().all()
+        keys = [f"b{n:06d}" for n in range(urls)]
+        db.session.execute(
+            insert(Url),
+            [
+                {
+                    "name": f"Benchmark {n}",
+                    "key": key,
+                    "target_url": f"https://example.com/{n}",
+                    "user_id": rng.choice(user_ids),
+                    "clicks": 0,
+                    "is_active": True,
+                }
+                for n, key in enumerate(keys)
+            ],
+        )
+        db.session.commit()
+        accounts = [
+            (f"bench{n}@example.com", create_access_token(identity=user_id))
+            for n, user_id in enumerate(user_ids)
+        ]
+    return keys, accounts
+
+
+def scenarios(keys, accounts, rng):
+    """
+    Returns name -> a function making (method, path, headers, json body)
+    """
+
+    def auth():
+        return {"Authorization": f"Bearer {rng.choice(accounts)[1]}"}
+
+    return {
+        "redirect": lambda: ("GET", f"/{rng.choice(keys)}", {}, None),
+        "click": lambda: ("PUT", f"/{rng.choice(keys)}/click", {}, None),
+        "create": lambda: (
+            "POST",
+            "/create",
+            auth(),
+            {"target url": f"https://example.com/new/{rng.random()}"},
+        ),
+        "login": lambda: (
+            "POST",
+            "/login",
+            {},
+            {"email": rng.choice(accounts)[0], "password": PASSWORD},
+        ),
+        "qrcode": lambda: ("POST", f"/{rng.choice(keys)}/qrcode", {}, None),
+    }
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return 0
+    index = min(len(latencies) - 1, round(fraction * (len(latencies) - 1)))
+    return latencies[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def drive(send, make_request, requests, concurrency):
+    """
+    Sends requests from concurrency threads and times each one
+    """
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        nonlocal errors
+        session = {}
+        for _ in remaining:
+            method, path, headers, body = make_request()
+            started = perf_counter()
+            try:
+                ok = send(session, method, path, headers, body)
+            except Exception:
+                ok = False
+            elapsed = perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+    started = perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, errors, perf_counter() - started)
+
+
+def client_sender(app):
+    client = app.test_client()
+
+    def send(session, method, path, headers, body):
+        response = client.open(path, method=method, headers=headers, json=body)
+        return response.status_code < 400
+
+    return send
+
+
+def http_sender(port):
+    def send(session, method, path, headers, body):
+        # one keep-alive connection per thread
+        connection = session.get("connection")
+        if connection is None:
+            connection = session["connection"] = http.client.HTTPConnection(
+                "127.0.0.1", port, timeout=30
+            )
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers = {**headers, "Content-Type": "application/json"}
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            session.pop("connection")
+            raise
+        return response.status < 400
+
+    return send
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers):
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            str(workers),
+            "--threads",
+            "4",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--log-level",
+            "warning",
+            "benchmarks.app:create_benchmark_app()",
+        ],
+        env={**os.environ, "BENCHMARK_DATABASE_URL": BENCHMARK_DATABASE_URL},
+    )
+    deadline = monotonic() + 30
+    while monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited while starting")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, port
+        except OSError:
+            sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def compare(previous, current):
+    """
+    Returns report lines of the change in throughput and p95 latency
+    """
+    lines = []
+    for target, results in current.items():
+        for name, result in results.items():
+            before = previous.get(target, {}).get(name)
+            if not before or not before["requests_per_second"]:
+                continue
+            throughput = (
+                result["requests_per_second"] / before["requests_per_second"] - 1
+            )
+            latency = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+            lines.append(
+                f"{target:<9} {name:<9} req/s {throughput:+8.1%}   p95 {latency:+8.1%}"
+            )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--urls", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--target", choices=("client", "gunicorn", "all"), default="all"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=("redirect", "click", "create", "login", "qrcode"),
+        help="Scenarios to run, every scenario by default",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join("benchmarks", "results.json"),
+        help="Where results are saved. A previous run saved there is the baseline",
+    )
+    parser.add_argument("--baseline", help="Compare against this results file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    app = create_benchmark_app()
+    keys, accounts = seed(app, args.users, args.urls, rng)
+    requests = scenarios(keys, accounts, rng)
+    names = args.scenario or list(requests)
+
+    results = {}
+    if args.target in ("client", "all"):
+        send = client_sender(app)
+        results["client"] = {
+            name: drive(send, requests[name], args.requests, args.concurrency)
+            for name in names
+        }
+    if args.target in ("gunicorn", "all"):
+        server, port = start_gunicorn(args.workers)
+        try:
+            send = http_sender(port)
+            results["gunicorn"] = {
+                name: drive(send, requests[name], args.requests, args.concurrency)
+                for name in names
+            }
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(
+        f"{'target':<9} {'scenario':<9} {'req/s':>9} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    )
+    for target, scenario_results in results.items():
+        for name, result in scenario_results.items():
+            print(
+                f"{target:<9} {name:<9} {result['requests_per_second']:>9} "
+                f"{result['p50_ms']:>9} {result['p95_ms']:>9} "
+                f"{result['p99_ms']:>9} {result['errors']:>7}"
+            )
+
+    baseline = args.baseline or args.output
+    if os.path.exists(baseline):
+        with open(baseline) as file:
+            previous = json.load(file)
+        lines = compare(previous["results"], results)
+        if lines:
+            print(f"\nCompared with {baseline} ({previous['meta']['time']}):")
+            print("\n".join(lines))
+
+    run = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(),
+            **{key: value for key, value in vars(args).items() if key != "baseline"},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(run, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+    return run